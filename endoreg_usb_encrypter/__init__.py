@@ -1 +1,9 @@
-from .functions import *
\ No newline at end of file
+import importlib
+
+from .functions import __all__
+
+
+def __getattr__(name):
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(".functions", __name__), name)
@@ -0,0 +1,344 @@
+# Command line entry point (endoreg-usb-encrypter)
+#
+# Only argparse is imported at startup; each subcommand imports the modules it
+# needs when it runs, so quick commands like `list` and `attach` stay fast.
+import argparse
+import importlib
+import sys
+
+DEFAULT_PARTITION_NAMES = ["dropoff", "processing", "processed"]
+DEFAULT_FACTORS = [0.33, 0.33, 0.33]
+DEFAULT_MOUNT_DIR = "/mnt/sensitive-hdd-mount"
+DEFAULT_KEY_DIR = "./sensitive-hdd-keys"
+DEFAULT_USER = "endoreg-service-user"
+DEFAULT_GROUP = "endoreg-service"
+
+# Startup budget checked by `bench`, in milliseconds
+DEFAULT_STARTUP_BUDGET_MS = 50.0
+
+# Modules each subcommand imports when it runs
+COMMAND_MODULES = {
+    "provision": ["provision", "custom_logging"],
+    "attach": ["attach", "custom_logging"],
+    "detach": ["attach", "custom_logging"],
+    "list": ["base", "custom_logging"],
+    "verify": ["remounting", "custom_logging"],
+    "bench": [],
+    "helper": ["privileged_helper", "custom_logging"],
+}
+
+
+def _load(command):
+    return [importlib.import_module(f"endoreg_usb_encrypter.functions.{name}") for name in COMMAND_MODULES[command]]
+
+
+def _logger(args):
+    from .functions.custom_logging import setup_logging
+    return setup_logging(args.logfile, json_log_file=args.json_log, device_log_dir=args.device_log_dir)
+
+
+def _ask(value, prompt, default, unattended):
+    # Flags take precedence; in unattended mode missing values fall back to the default
+    if value is not None:
+        return value
+    if unattended:
+        return default
+    answer = input(prompt).strip()
+    return answer if answer else default
+
+
+def _throughput_options(args):
+    return {
+        "probe_size": args.probe_size * 1024 * 1024 if args.throughput else None,
+        "min_write_mbps": args.min_write_mbps,
+        "min_read_mbps": args.min_read_mbps,
+        "fail_below_floor": not args.flag_only,
+    }
+
+
+def _add_throughput_arguments(parser):
+    parser.add_argument("--throughput", action="store_true", help="Verify the read/write throughput of the LUKS volumes")
+    parser.add_argument("--probe-size", type=int, default=64, help="Throughput probe size in MiB")
+    parser.add_argument("--min-write-mbps", type=float, default=None, help="Sequential write floor in MiB/s")
+    parser.add_argument("--min-read-mbps", type=float, default=None, help="Sequential read floor in MiB/s")
+    parser.add_argument("--flag-only", action="store_true", help="Only flag drives below the floor instead of failing")
+
+
+def _parse_sizes(value, logger):
+    if isinstance(value, list):
+        return value
+    size_factors = [float(s) / 100 for s in value.split(",")]
+    if len(size_factors) != 3 or abs(sum(size_factors) - 1.0) > 0.011:
+        logger.error("Invalid partition size percentages. Using default values.")
+        return DEFAULT_FACTORS
+    return size_factors
+
+
+def cmd_provision(args):
+    provision, _ = _load("provision")
+    logger = _logger(args)
+
+    if args.device is None:
+        if args.yes:
+            logger.error("--device is required with --yes")
+            return 2
+        from .functions.base import list_devices
+        list_devices(logger)
+    device = _ask(args.device, "Please enter the full path of the device you wish to format (e.g., /dev/sdb): ", None, args.yes)
+    if not device:
+        logger.error("No device given.")
+        return 2
+
+    names = _ask(args.partition_names, "Enter partition names separated by commas (default: dropoff,processing,processed): ", ",".join(DEFAULT_PARTITION_NAMES), args.yes)
+    partition_names = [name.strip() for name in names.split(",")]
+    if len(partition_names) != 3:
+        partition_names = DEFAULT_PARTITION_NAMES
+
+    sizes = _ask(args.sizes, "Enter partition sizes as percentages (default: 33,33,33): ", DEFAULT_FACTORS, args.yes)
+    size_factors = _parse_sizes(sizes, logger)
+
+    mount_dir = _ask(args.mount_dir, f"Enter a target directory for mounting LUKS partitions (default: {DEFAULT_MOUNT_DIR}): ", DEFAULT_MOUNT_DIR, args.yes)
+    key_dir = _ask(args.key_dir, f"Enter a directory to store encryption keys (default: {DEFAULT_KEY_DIR}): ", DEFAULT_KEY_DIR, args.yes)
+
+    if not args.yes:
+        confirm = input(f"Are you sure you want to format and partition {device}? This will destroy all data on the device. (yes/no): ").strip().lower()
+        if confirm != "yes":
+            logger.info("Operation canceled by the user.")
+            return 1
+
+    provision.prepare_directory(mount_dir, args.user, args.group, logger)
+    provision.prepare_directory(key_dir, args.user, args.group, logger)
+
+    provision.provision_device(
+        device,
+        partition_names,
+        size_factors,
+        mount_dir,
+        key_dir,
+        logger,
+        output_json=args.output,
+        hdd_info_json=args.hddinfo,
+        nix_output_file=args.nixfile,
+        **_throughput_options(args),
+    )
+    return 0
+
+
+def cmd_attach(args):
+    attach, _ = _load("attach")
+    logger = _logger(args)
+    try:
+        attach.attach_device(args.device, args.mount_dir, args.key_dir, logger, check=not args.skip_check)
+    except attach.FilesystemCheckError as e:
+        logger.error(str(e))
+        return 1
+    return 0
+
+
+def cmd_detach(args):
+    attach, _ = _load("detach")
+    attach.detach_device(args.device, args.mount_dir, _logger(args))
+    return 0
+
+
+def cmd_list(args):
+    base, _ = _load("list")
+    base.list_devices(_logger(args))
+    return 0
+
+
+def cmd_verify(args):
+    verify, _ = _load("verify")
+    logger = _logger(args)
+    if args.throughput:
+        from .functions.throughput import require_local_probes
+        require_local_probes()
+    verify.unmount_and_mount_all_partitions(args.device, args.mount_dir, logger, args.key_dir)
+    if not args.throughput:
+        return 0
+
+    import json
+    import os
+    from .functions.base import list_partitions
+    from .functions.throughput import ThroughputBelowFloorError, verify_throughput
+
+    if os.path.exists(args.hddinfo):
+        with open(args.hddinfo) as hdd_json_file:
+            hdd_info = json.load(hdd_json_file)
+    else:
+        hdd_info = {"device": args.device, "partitions": [{"partition": f"/dev/{p}"} for p in list_partitions(args.device, logger)]}
+
+    options = _throughput_options(args)
+    try:
+        verify_throughput(
+            hdd_info, args.mount_dir, logger,
+            size=options["probe_size"],
+            min_write_mbps=options["min_write_mbps"],
+            min_read_mbps=options["min_read_mbps"],
+            fail_below_floor=options["fail_below_floor"],
+        )
+    except ThroughputBelowFloorError as e:
+        logger.error(str(e))
+        return 1
+    finally:
+        with open(args.hddinfo, "w") as hdd_json_file:
+            json.dump(hdd_info, hdd_json_file, indent=4)
+        logger.info(f"Throughput results written to {args.hddinfo}")
+    return 0
+
+
+def measure_startup(command, runs=5):
+    """
+    Measure the wall-clock time to start the CLI and import a subcommand's modules.
+
+    Each run spawns a fresh interpreter, as an operator invoking the command would.
+
+    Returns:
+        list[float]: The measured durations in milliseconds.
+    """
+    import subprocess
+    import time
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "endoreg_usb_encrypter", "--import-only", command], check=True)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def cmd_helper(args):
+    privileged_helper, _ = _load("helper")
+    import pwd
+
+    server = privileged_helper.PrivilegedHelperServer(
+        _logger(args),
+        socket_path=args.socket,
+        allowed_uids=[pwd.getpwnam(user).pw_uid for user in args.allow_user],
+        allowed_group=args.allow_group,
+        mount_roots=args.mount_root or privileged_helper.DEFAULT_MOUNT_ROOTS,
+        key_roots=args.key_root,
+    )
+    try:
+        server.serve_forever(socket_group=args.allow_group)
+    except KeyboardInterrupt:
+        server.close()
+    return 0
+
+
+def cmd_bench(args):
+    import statistics
+
+    unknown = [command for command in args.commands if command not in COMMAND_MODULES]
+    if unknown:
+        print(f"Unknown subcommands: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    failed = False
+    for command in args.commands:
+        median = statistics.median(measure_startup(command, args.runs))
+        within = median <= args.budget_ms
+        failed = failed or not within
+        print(f"{command}: {median:.1f} ms (budget {args.budget_ms:.0f} ms) {'ok' if within else 'SLOW'}")
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="endoreg-usb-encrypter", description="List devices, format, partition, and encrypt a USB drive.")
+    parser.add_argument("--logfile", default="usb_encryption.log", help="Log file location")
+    parser.add_argument("--json-log", default=None, help="Additional JSON-lines log file")
+    parser.add_argument("--device-log-dir", default=None, help="Directory for per-device log files (<host>-<device>.log for remote hosts)")
+    parser.add_argument("--helper-socket", default=None, help="Run privileged operations through the privileged helper listening on this socket")
+    parser.add_argument("--metrics-textfile", default=None, help="Write Prometheus metrics to this file when the command ends (node-exporter textfile collector)")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port while the command runs")
+    parser.add_argument("--metrics-address", default="127.0.0.1", help="Address the metrics endpoint listens on")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    provision = subparsers.add_parser("provision", help="Partition, encrypt and format a device")
+    provision.add_argument("--device", default=None, help="Device to provision, e.g. /dev/sdb")
+    provision.add_argument("--partition-names", default=None, help="Partition names separated by commas")
+    provision.add_argument("--sizes", default=None, help="Partition sizes as percentages separated by commas")
+    provision.add_argument("--mount-dir", default=None, help="Target directory for mounting LUKS partitions")
+    provision.add_argument("--key-dir", default=None, help="Directory to store encryption keys")
+    provision.add_argument("--user", default=DEFAULT_USER, help="Owner of the mount and key directories")
+    provision.add_argument("--group", default=DEFAULT_GROUP, help="Group of the mount and key directories")
+    provision.add_argument("--output", default="output.json", help="Output JSON file")
+    provision.add_argument("--hddinfo", default="hdd-info.json", help="HDD info JSON file location")
+    provision.add_argument("--nixfile", default="sensitive-hdd.nix", help="Output Nix file location")
+    provision.add_argument("--yes", action="store_true", help="Run unattended: use defaults for missing options and skip the confirmation")
+    _add_throughput_arguments(provision)
+    provision.set_defaults(func=cmd_provision)
+
+    for name, func, help_text in (
+        ("attach", cmd_attach, "Decrypt and mount all partitions of a device"),
+        ("detach", cmd_detach, "Unmount and close all partitions of a device"),
+        ("verify", cmd_verify, "Unmount and remount all partitions of a device and optionally check their throughput"),
+    ):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("device", help="Device, e.g. /dev/sdb")
+        sub.add_argument("--mount-dir", default=DEFAULT_MOUNT_DIR, help="Directory the LUKS partitions are mounted below")
+        if name != "detach":
+            sub.add_argument("--key-dir", default=DEFAULT_KEY_DIR, help="Directory containing the encryption keys")
+        if name == "attach":
+            sub.add_argument("--skip-check", action="store_true", help="Mount without checking the file systems first")
+        if name == "verify":
+            sub.add_argument("--hddinfo", default="hdd-info.json", help="HDD info JSON file the throughput results are recorded in")
+            _add_throughput_arguments(sub)
+        sub.set_defaults(func=func)
+
+    list_parser = subparsers.add_parser("list", help="List available devices")
+    list_parser.set_defaults(func=cmd_list)
+
+    helper = subparsers.add_parser("helper", help="Run the privileged helper (as root)")
+    helper.add_argument("--socket", default="/run/endoreg-usb-encrypter/helper.sock", help="Socket path to listen on")
+    helper.add_argument("--allow-user", action="append", default=[], help="User allowed to connect (repeatable)")
+    helper.add_argument("--allow-group", default=None, help="Group allowed to connect; also owns the socket")
+    helper.add_argument("--mount-root", action="append", default=[], help="Directory below which mounts are allowed (repeatable, default: /mnt, /media, /run/media)")
+    helper.add_argument("--key-root", action="append", default=[], help="Directory below which key files are accepted (repeatable; required for LUKS operations)")
+    helper.set_defaults(func=cmd_helper)
+
+    bench = subparsers.add_parser("bench", help="Check the CLI startup time of subcommands")
+    bench.add_argument("commands", nargs="*", default=["list", "attach"], help=f"Subcommands to measure ({', '.join(COMMAND_MODULES)})")
+    bench.add_argument("--runs", type=int, default=5, help="Number of runs per subcommand")
+    bench.add_argument("--budget-ms", type=float, default=DEFAULT_STARTUP_BUDGET_MS, help="Maximum median startup time")
+    bench.set_defaults(func=cmd_bench)
+
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    # Used by `bench`: import what a subcommand needs, then exit
+    if argv[:1] == ["--import-only"]:
+        if len(argv) != 2 or argv[1] not in COMMAND_MODULES:
+            print(f"usage: --import-only {{{','.join(COMMAND_MODULES)}}}", file=sys.stderr)
+            return 2
+        _load(argv[1])
+        return 0
+
+    args = build_parser().parse_args(argv)
+    if args.metrics_port is not None:
+        from .functions.metrics import start_http_server
+        start_http_server(args.metrics_port, args.metrics_address)
+    try:
+        return _run(args)
+    finally:
+        if args.metrics_textfile:
+            from .functions.metrics import write_textfile
+            write_textfile(args.metrics_textfile)
+
+
+def _run(args):
+    if args.helper_socket and args.command not in ("helper", "bench"):
+        from .functions.base import use_privileged_helper
+        from .functions.privileged_helper import PrivilegedHelperClient
+
+        # One helper session for the whole command
+        with PrivilegedHelperClient(args.helper_socket) as client, use_privileged_helper(client):
+            return args.func(args)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
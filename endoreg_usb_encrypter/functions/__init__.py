@@ -1,10 +1,62 @@
-from .base import run_command, list_devices, format_partition
-from .custom_logging import setup_logging
-from .cleanup_device import cleanup_device
-from .create_partitions import create_partitions
-from .decrypt_and_mount_partition import decrypt_and_mount_partition
-from .encrypt_partition import encrypt_partition
-from .unmount_and_mount_all_partitions import unmount_and_mount_all_partitions
-from .unmount_partitions import unmount_partitions
+# Exports are resolved on first access, so importing the package (e.g. from the
+# CLI) only loads the modules a command actually uses.
+import importlib
 
+_EXPORTS = {
+    "run_command": ".base",
+    "use_executor": ".base",
+    "get_executor": ".base",
+    "use_privileged_helper": ".base",
+    "get_privileged_helper": ".base",
+    "stream_command": ".base",
+    "list_devices": ".base",
+    "list_partitions": ".base",
+    "device_state": ".base",
+    "format_partition": ".base",
+    "ProgressEvent": ".progress",
+    "ProgressParser": ".progress",
+    "setup_logging": ".custom_logging",
+    "shutdown_logging": ".custom_logging",
+    "log_context": ".custom_logging",
+    "cleanup_device": ".cleanup",
+    "create_partitions": ".partitioning",
+    "decrypt_and_mount_partition": ".decryption",
+    "encrypt_partition": ".encryption",
+    "unmount_and_mount_all_partitions": ".remounting",
+    "unmount_partitions": ".unmounting",
+    "attach_device": ".attach",
+    "detach_device": ".attach",
+    "provision_device": ".provision",
+    "write_nix_configuration": ".provision",
+    "SSHConnectionPool": ".remote",
+    "SSHExecutor": ".remote",
+    "provision_hosts": ".remote",
+    "PrivilegedHelperServer": ".privileged_helper",
+    "PrivilegedHelperClient": ".privileged_helper",
+    "read_device_state": ".block_devices",
+    "verify_throughput": ".throughput",
+    "probe_volume": ".throughput",
+    "probe_device_read": ".throughput",
+    "ThroughputBelowFloorError": ".throughput",
+    "check_filesystem": ".filesystem_check",
+    "check_filesystems": ".filesystem_check",
+    "read_ext4_state": ".filesystem_check",
+    "FilesystemCheckError": ".filesystem_check",
+    "REGISTRY": ".metrics",
+    "write_textfile": ".metrics",
+    "start_http_server": ".metrics",
+}
 
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,82 @@
+import os
+
+from .base import list_partitions, path_exists, is_mount, unmount, luks_close
+from .filesystem_check import FilesystemCheckError, check_filesystems
+from .decryption import open_luks_partition, mount_luks_partition
+from .metrics import ATTACH_DURATION
+
+
+# Function to decrypt, check and mount all partitions of a device
+def attach_device(device, mount_dir, key_dir, logger, check=True, max_workers=None):
+    """
+    Open all LUKS partitions of a device, check their file systems in parallel and mount those that pass.
+
+    Volumes whose check fails stay open but unmounted, so they can be repaired.
+
+    Args:
+        device (str): The device, e.g. "/dev/sdb".
+        mount_dir (str): Directory the LUKS partitions are mounted below.
+        key_dir (str): Directory containing the key files.
+        logger (logging.Logger): The logger.
+        check (bool): Check the file systems before mounting.
+        max_workers (int, optional): Number of parallel checks; defaults to one per partition.
+
+    Returns:
+        list[str]: The mount paths.
+
+    Raises:
+        FilesystemCheckError: If a file system failed the check; the other partitions are mounted.
+    """
+    logger.info(f"Attaching all partitions of {device}")
+
+    mount_paths = []
+    results = {}
+    with ATTACH_DURATION.time():
+        partitions = [f"/dev/{partition}" for partition in list_partitions(device, logger)]
+        mapped_devices = []
+        for partition_path in partitions:
+            key_file = f"{key_dir}/key-{os.path.basename(partition_path)}.key"
+            mapped_devices.append(open_luks_partition(partition_path, key_file, logger))
+
+        if check:
+            checks = check_filesystems(mapped_devices, logger, max_workers=max_workers)
+            results = {partition_path: checks[mapped_device] for partition_path, mapped_device in zip(partitions, mapped_devices)}
+            for partition_path, result in results.items():
+                logger.info(
+                    f"File system check of {partition_path}: {'passed' if result['passed'] else 'FAILED'} "
+                    f"({result['method']}, exit code {result['exit_code']}, {result['duration']}s)"
+                )
+
+        for partition_path, mapped_device in zip(partitions, mapped_devices):
+            if check and not results[partition_path]["passed"]:
+                logger.error(f"Not mounting {partition_path}: its file system check failed, {mapped_device} is left open for repair")
+                continue
+            mount_paths.append(mount_luks_partition(partition_path, mount_dir, logger))
+
+    failed = [partition_path for partition_path, result in results.items() if not result["passed"]]
+    if failed:
+        raise FilesystemCheckError(f"File system check failed for {', '.join(failed)} of {device}", results)
+
+    logger.info(f"Attached {len(mount_paths)} partitions of {device}")
+    return mount_paths
+
+
+# Function to unmount and close the LUKS partitions of a device
+def detach_device(device, mount_dir, logger):
+    logger.info(f"Detaching all partitions of {device}")
+
+    for partition in list_partitions(device, logger):
+        luks_partition_name = f"luks-{partition}"
+        luks_mapped_device = f"/dev/mapper/{luks_partition_name}"
+        if not path_exists(luks_mapped_device):
+            logger.info(f"LUKS device {luks_partition_name} is not open, skipping.")
+            continue
+
+        mount_path = os.path.join(mount_dir, luks_partition_name)
+        if is_mount(mount_path):
+            logger.info(f"Unmounting {luks_mapped_device} from {mount_path}")
+            unmount(mount_path, logger)
+
+        luks_close(luks_partition_name, logger)
+
+    logger.info(f"All partitions of {device} detached.")
@@ -1,16 +1,202 @@
 # Function to run a shell command and capture output
+import codecs
+import contextvars
+import os
+import selectors
+import shlex
 import subprocess
+from collections import deque
+from contextlib import contextmanager
 
+from .metrics import COMMAND_DURATION, command_name, record_formatted
 
-def run_command(command, logger):
+# Percent steps in which progress is reported to the console
+CONSOLE_PROGRESS_STEP = 10.0
+
+# Executor that runs commands instead of the local shell (e.g. an SSHExecutor).
+# Stored in a context variable so concurrent threads can target different hosts.
+_executor = contextvars.ContextVar("usb_encryption_executor", default=None)
+
+
+@contextmanager
+def use_executor(executor):
+    """
+    Run all commands issued inside the block through `executor`.
+
+    An executor provides `run(command, check=False, on_output=None)` returning a
+    subprocess.CompletedProcess, plus `path_exists`, `make_dirs`, `is_mount` and
+    `write_key_file`. Passing None restores local execution.
+    """
+    token = _executor.set(executor)
     try:
-        result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        yield executor
+    finally:
+        _executor.reset(token)
+
+
+def get_executor():
+    return _executor.get()
+
+
+# Client of the privileged helper process (see privileged_helper.py). While set,
+# the privileged operations below are sent to the helper instead of running tools.
+_privileged_helper = contextvars.ContextVar("usb_encryption_privileged_helper", default=None)
+
+
+@contextmanager
+def use_privileged_helper(client):
+    """Route the privileged operations issued inside the block through `client`."""
+    token = _privileged_helper.set(client)
+    try:
+        yield client
+    finally:
+        _privileged_helper.reset(token)
+
+
+def get_privileged_helper():
+    return _privileged_helper.get()
+
+
+def run_command(command, logger, stream=False, on_progress=None, label=None):
+    if stream or on_progress is not None:
+        return stream_command(command, logger, on_progress=on_progress, label=label)
+    executor = get_executor()
+    try:
+        with COMMAND_DURATION.time(command=command_name(command)):
+            if executor is None:
+                result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            else:
+                result = executor.run(command, check=True)
         logger.debug(f"Command '{command}' succeeded with output: {result.stdout.decode('utf-8').strip()}")
         return result.stdout.decode('utf-8').strip()
     except subprocess.CalledProcessError as e:
         logger.error(f"Command '{command}' failed with error: {e.stderr.decode('utf-8')}")
         raise
 
+
+def _read_local(command, on_output):
+    # Argument lists run without a shell
+    process = subprocess.Popen(command, shell=isinstance(command, str), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    names = {process.stdout.fileno(): "stdout", process.stderr.fileno(): "stderr"}
+    with selectors.DefaultSelector() as selector:
+        for fd in names:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                chunk = os.read(key.fd, 4096)
+                if not chunk:
+                    selector.unregister(key.fd)
+                on_output(names[key.fd], chunk)
+    returncode = process.wait()
+    process.stdout.close()
+    process.stderr.close()
+    return returncode
+
+
+# Function to run a shell command while reading its output incrementally
+def stream_command(command, logger, on_progress=None, label=None, tail_lines=200):
+    """
+    Run a shell command and process its output while it is produced.
+
+    Progress reported by the tool (mkfs inode tables) is published as
+    ProgressEvent objects to `on_progress` and summarized on the console in
+    CONSOLE_PROGRESS_STEP increments. Only the last `tail_lines` lines of each
+    stream are kept in memory.
+
+    Args:
+        command (str | list[str]): The shell command, or an argument list run without a shell.
+        logger (logging.Logger): Logger for output and progress messages.
+        on_progress (callable, optional): Called with every ProgressEvent.
+        label (str, optional): Identifies the command in progress events. Defaults to the command.
+        tail_lines (int): Number of output lines kept per stream.
+
+    Returns:
+        str: The retained stdout lines, stripped.
+    """
+    # Imported here to keep CLI startup for non-streaming commands fast
+    from .progress import ProgressParser, format_progress
+
+    if not isinstance(command, str):
+        command = list(command)
+    label = label or (command if isinstance(command, str) else " ".join(command))
+    tails = {"stdout": deque(maxlen=tail_lines), "stderr": deque(maxlen=tail_lines)}
+    streams = {
+        name: (ProgressParser(label), codecs.getincrementaldecoder("utf-8")(errors="replace"), tail)
+        for name, tail in tails.items()
+    }
+    reported = {}
+
+    def publish(events, lines, tail):
+        for line in lines:
+            logger.debug(f"[{label}] {line}")
+            tail.append(line)
+        for event in events:
+            if on_progress is not None:
+                on_progress(event)
+            last = reported.get(event.stage)
+            if last is None or event.percent >= last + CONSOLE_PROGRESS_STEP or event.percent >= 100.0 > last:
+                reported[event.stage] = event.percent
+                logger.info(format_progress(event))
+
+    def on_output(name, chunk):
+        # An empty chunk marks the end of the stream
+        parser, decoder, tail = streams[name]
+        if chunk:
+            publish(*parser.feed(decoder.decode(chunk)), tail)
+        else:
+            publish(*parser.feed(decoder.decode(b"", final=True)), tail)
+            publish(*parser.flush(), tail)
+
+    executor = get_executor()
+    with COMMAND_DURATION.time(command=command_name(command)):
+        if executor is None:
+            returncode = _read_local(command, on_output)
+        else:
+            returncode = executor.run(command if isinstance(command, str) else shlex.join(command), on_output=on_output).returncode
+
+    stdout = "\n".join(tails["stdout"]).strip()
+    stderr = "\n".join(tails["stderr"])
+    if returncode != 0:
+        logger.error(f"Command '{command}' failed with error: {stderr}")
+        raise subprocess.CalledProcessError(returncode, command, output=stdout, stderr=stderr)
+    logger.debug(f"Command '{command}' succeeded")
+    return stdout
+
+
+# Functions for file system access on the host commands run on
+def path_exists(path):
+    executor = get_executor()
+    return os.path.exists(path) if executor is None else executor.path_exists(path)
+
+
+def is_mount(path):
+    executor = get_executor()
+    return os.path.ismount(path) if executor is None else executor.is_mount(path)
+
+
+def make_dirs(path, mode=None):
+    executor = get_executor()
+    helper = get_privileged_helper()
+    if helper is not None:
+        # The helper only creates mount directories, which keep the default mode
+        helper.call("make_dirs", path=os.path.abspath(path))
+    elif executor is None:
+        os.makedirs(path, exist_ok=True)
+        if mode is not None:
+            os.chmod(path, mode)
+    else:
+        executor.make_dirs(path, mode=mode)
+
+
+def write_key_file(key_file, key, logger):
+    executor = get_executor()
+    if executor is None:
+        with open(key_file, "wb") as keyf:
+            keyf.write(key)
+    else:
+        executor.write_key_file(key_file, key)
+    logger.debug(f"Key file written: {key_file}")
+
 # Function to list available devices
 def list_devices(logger):
     logger.info("Listing available devices...")
@@ -19,10 +205,146 @@ def list_devices(logger):
     print(devices)
     return devices
 
+# Function to read the partitions, open LUKS mappings and mounts of a device
+def device_state(device, logger):
+    """
+    The state of `device` as returned by device_state.read_device_state.
+
+    Read by the privileged helper if one is in use, from sysfs for local
+    devices and with lsblk on remote hosts.
+    """
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "device_state", device=device)
+    # Imported here to keep CLI startup for commands without device state fast
+    from .block_devices import parse_lsblk, read_device_state
+    if get_executor() is None:
+        return read_device_state(device)
+    return parse_lsblk(run_command(f"lsblk -J -o NAME,TYPE,MOUNTPOINT {device}", logger))
+
+# Function to list the partition names (e.g. "sdb1") of a device
+def list_partitions(device, logger):
+    return device_state(device, logger)["partitions"]
+
+# Privileged operations: sent to the privileged helper if one is in use,
+# otherwise run as commands
+def _privileged(logger, operation, on_progress=None, **args):
+    logger.debug(f"Privileged helper operation '{operation}': {args}")
+    with COMMAND_DURATION.time(command=f"helper:{operation}"):
+        return get_privileged_helper().call(operation, on_progress=on_progress, **args)
+
+
+def mount_device(device, mount_path, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "mount", device=device, mount_path=os.path.abspath(mount_path))
+    run_command(f"mount {device} {mount_path}", logger)
+
+
+def unmount(target, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "umount", target=os.path.abspath(target))
+    run_command(f"umount {target}", logger)
+
+
+def luks_format(partition, key_file, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "format_luks", device=partition, key_file=os.path.abspath(key_file))
+    run_command(f"cryptsetup luksFormat {partition} {key_file} -q", logger)
+
+
+def luks_open(partition, luks_name, key_file, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "open_luks", device=partition, name=luks_name, key_file=os.path.abspath(key_file))
+    run_command(f"cryptsetup open {partition} {luks_name} --key-file={key_file}", logger)
+
+
+def luks_close(luks_name, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "close_luks", name=luks_name)
+    run_command(f"cryptsetup close {luks_name}", logger)
+
+
+def luks_uuid(partition, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "luks_uuid", device=partition)
+    return run_command(f"cryptsetup luksUUID {partition}", logger)
+
+
+def make_partition_table(device, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "make_partition_table", device=device)
+    run_command(f"parted -s {device} mklabel gpt", logger)
+    run_command(f"partprobe {device}", logger)
+
+
+def add_partition(device, name, start, end, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "add_partition", device=device, name=name, start=int(start), end=int(end))
+    run_command(f"parted -s {device} mkpart {name} ext4 {int(start)}% {int(end)}%", logger)
+    run_command(f"partprobe {device}", logger)
+
+
+def reread_partitions(device, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "reread_partitions", device=device)
+    run_command(f"partprobe {device}", logger)
+
+
+def make_ext4(device, logger, label=None, on_progress=None, progress_label=None):
+    if get_privileged_helper() is not None:
+        _privileged(logger, "mkfs", device=device, label=label, on_progress=on_progress)
+    else:
+        run_command(f"mkfs.ext4 {device}", logger, stream=True, on_progress=on_progress, label=progress_label or device)
+        if label:
+            run_command(f"e2label {device} {label}", logger)
+    # The size is read from sysfs, which only describes local devices
+    if get_executor() is None:
+        record_formatted(device)
+
+
+def filesystem_uuid(device, logger):
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "filesystem_uuid", device=device)
+    return run_command(f"blkid -s UUID -o value {device}", logger)
+
+
+def filesystem_state(device, logger):
+    """The ext4 superblock state of `device` (see check_filesystem.read_ext4_state), or None if it cannot be read here."""
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "filesystem_state", device=device)
+    if get_executor() is not None:
+        # The superblock is read in-process, which only works for local devices
+        return None
+    # Imported here to keep CLI startup for commands without checks fast
+    from .filesystem_check import read_ext4_state
+    return read_ext4_state(device)
+
+
+def fsck_preen(device, logger):
+    """Run `e2fsck -p` on `device`. Returns its exit code; raises CalledProcessError if it could not fix the file system."""
+    if get_privileged_helper() is not None:
+        return _privileged(logger, "fsck", device=device)
+    # Not run through run_command: exit codes 1 and 2 mean that errors were
+    # corrected and must not be logged as a failure
+    argv = ["e2fsck", "-p", device]
+    executor = get_executor()
+    with COMMAND_DURATION.time(command=argv[0]):
+        if executor is None:
+            result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            result = executor.run(shlex.join(argv))
+    if result.returncode >= 4:
+        raise subprocess.CalledProcessError(result.returncode, argv, output=result.stdout, stderr=result.stderr)
+    if result.returncode:
+        logger.info(f"e2fsck corrected errors on {device} (exit code {result.returncode})")
+        output = b"".join(stream for stream in (result.stdout, result.stderr) if stream)
+        logger.debug(f"e2fsck output for {device}: {output.decode('utf-8', 'replace').strip()}")
+    return result.returncode
+
+
 # Function to format partitions with ext4
-def format_partition(partition, logger):
+def format_partition(partition, logger, on_progress=None):
     logger.info(f"Formatting partition {partition} as ext4")
-    run_command(f"mkfs.ext4 {partition}", logger)
-    partition_uuid = run_command(f"blkid -s UUID -o value {partition}", logger)
+    make_ext4(partition, logger, on_progress=on_progress)
+    partition_uuid = filesystem_uuid(partition, logger)
     logger.debug(f"Formatted partition {partition}, UUID: {partition_uuid}")
     return partition_uuid
\ No newline at end of file
@@ -0,0 +1,106 @@
+# Partitions, open LUKS mappings and mounts of a device, read without running tools
+import json
+import os
+import re
+
+
+def _unescape_mountinfo(value):
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), value)
+
+
+def read_mounts():
+    """Return (source, mount point) pairs from /proc/self/mountinfo."""
+    mounts = []
+    with open("/proc/self/mountinfo") as mountinfo:
+        for line in mountinfo:
+            fields, _, super_fields = line.partition(" - ")
+            mount_point = _unescape_mountinfo(fields.split()[4])
+            source = _unescape_mountinfo(super_fields.split()[1])
+            mounts.append((source, mount_point))
+    return mounts
+
+
+def _device_number(sys_dir):
+    with open(os.path.join(sys_dir, "dev")) as dev_file:
+        major, minor = dev_file.read().strip().split(":")
+    return os.makedev(int(major), int(minor))
+
+
+def stacked_devices(device):
+    """Device numbers of a block device, its partitions and everything stacked on them (e.g. LUKS mappings)."""
+    rdev = os.stat(device).st_rdev
+    numbers = set()
+    pending = [f"/sys/dev/block/{os.major(rdev)}:{os.minor(rdev)}"]
+    while pending:
+        sys_dir = os.path.realpath(pending.pop())
+        number = _device_number(sys_dir)
+        if number in numbers:
+            continue
+        numbers.add(number)
+        pending += [os.path.join(sys_dir, entry) for entry in os.listdir(sys_dir) if os.path.exists(os.path.join(sys_dir, entry, "partition"))]
+        pending += [os.path.join(sys_dir, "holders", holder) for holder in os.listdir(os.path.join(sys_dir, "holders"))]
+    return numbers
+
+
+def device_mounts(device):
+    """Mount points of a block device, its partitions and the devices stacked on them, matched by device number."""
+    numbers = stacked_devices(device)
+    mount_points = []
+    with open("/proc/self/mountinfo") as mountinfo:
+        for line in mountinfo:
+            fields = line.split()
+            major, minor = fields[2].split(":")
+            if os.makedev(int(major), int(minor)) in numbers:
+                mount_points.append(_unescape_mountinfo(fields[4]))
+    return mount_points
+
+
+def read_device_state(device):
+    """
+    Read partitions, open LUKS mappings and mounts of a device from sysfs and mountinfo.
+
+    Returns:
+        dict: {"partitions": [...], "luks": {partition: mapping}, "mounts": {source: [mount points]}}
+    """
+    name = os.path.basename(device)
+    sys_dir = f"/sys/class/block/{name}"
+    partitions = sorted(
+        entry for entry in os.listdir(sys_dir)
+        if entry.startswith(name) and os.path.exists(os.path.join(sys_dir, entry, "partition"))
+    )
+
+    luks = {}
+    for partition in partitions:
+        holders_dir = os.path.join(sys_dir, partition, "holders")
+        for holder in os.listdir(holders_dir):
+            with open(f"/sys/class/block/{holder}/dm/name") as dm_name:
+                luks[partition] = dm_name.read().strip()
+
+    sources = {f"/dev/{name}"} | {f"/dev/{p}" for p in partitions} | {f"/dev/mapper/{m}" for m in luks.values()}
+    mounts = {}
+    for source, mount_point in read_mounts():
+        if source in sources:
+            mounts.setdefault(source, []).append(mount_point)
+    return {"partitions": partitions, "luks": luks, "mounts": mounts}
+
+
+def parse_lsblk(output):
+    """Build the read_device_state record from `lsblk -J -o NAME,TYPE,MOUNTPOINT <device>` output (remote hosts)."""
+    disk = json.loads(output)["blockdevices"][0]
+    partitions, luks, mounts = [], {}, {}
+
+    def add_mounts(source, entry):
+        if entry.get("mountpoint"):
+            mounts.setdefault(source, []).append(entry["mountpoint"])
+
+    add_mounts(f"/dev/{disk['name']}", disk)
+    for partition in disk.get("children") or []:
+        if partition.get("type") != "part":
+            continue
+        partitions.append(partition["name"])
+        add_mounts(f"/dev/{partition['name']}", partition)
+        for holder in partition.get("children") or []:
+            if holder.get("type") == "crypt":
+                luks[partition["name"]] = holder["name"]
+                add_mounts(f"/dev/mapper/{holder['name']}", holder)
+    return {"partitions": sorted(partitions), "luks": luks, "mounts": mounts}
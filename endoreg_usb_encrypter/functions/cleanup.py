@@ -0,0 +1,28 @@
+from .base import device_state, unmount, luks_close, reread_partitions
+
+# Function to unmount all partitions and close LUKS devices on a device
+def cleanup_device(device, mount_dir, logger):
+    logger.info(f"Unmounting all partitions and closing LUKS devices on {device}")
+    state = device_state(device, logger)
+
+    # Unmount the LUKS volumes first, then the partitions and the device itself
+    sources = [f"/dev/mapper/{mapping}" for mapping in state["luks"].values()]
+    sources += [f"/dev/{partition}" for partition in state["partitions"]] + [device]
+    for source in sources:
+        mount_points = state["mounts"].get(source, [])
+        if not mount_points:
+            logger.info(f"{source} is not mounted, skipping.")
+        # Unmount the most recent mount first in case mounts are stacked
+        for mount_point in reversed(mount_points):
+            logger.info(f"Unmounting {source} from {mount_point}")
+            unmount(mount_point, logger)
+
+    # Close the LUKS devices opened on the partitions of this device
+    if not state["luks"]:
+        logger.info("No LUKS devices found, skipping LUKS cleanup.")
+    for mapping in state["luks"].values():
+        luks_close(mapping, logger)
+
+    # Inform the kernel of partition changes using partprobe
+    logger.info(f"Running partprobe on {device}")
+    reread_partitions(device, logger)
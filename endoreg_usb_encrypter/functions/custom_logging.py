@@ -1,34 +1,219 @@
 # Setup logging
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
-def setup_logging(log_file:str="usb_encryption.log"):
+LOGGER_NAME = "USBEncryption"
+CONTEXT_FIELDS = ("host", "device", "partition", "step")
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(context_prefix)s%(message)s'
+
+_log_context = contextvars.ContextVar("usb_encryption_log_context", default={})
+_lock = threading.Lock()
+_state = {"queue_handler": None, "listener": None, "handlers": {}, "atexit": False}
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Attach context fields (host, device, partition, step) to all records logged inside the block.
+
+    The context is stored in a context variable, so concurrent provisioning
+    threads each keep their own fields.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log context onto the record in the calling thread."""
+
+    def filter(self, record):
+        context = _log_context.get()
+        for name in CONTEXT_FIELDS:
+            setattr(record, name, context.get(name))
+        values = [os.path.basename(str(context[name])) for name in CONTEXT_FIELDS if context.get(name)]
+        record.context_prefix = f"[{'/'.join(values)}] " if values else ""
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including the context fields."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for name in CONTEXT_FIELDS:
+            entry[name] = getattr(record, name, None)
+        # Records from the queue carry the formatted traceback in exc_text
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that keeps the traceback of a record out of its message.
+
+    QueueHandler.prepare folds the traceback into the message and drops
+    exc_info; here the traceback is kept in exc_text instead, which the text
+    formatters append as usual and the JSON formatter reports as its own field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class DeviceFileHandler(logging.Handler):
+    """
+    Writes records that carry a device context into one log file per device.
+
+    Records without a device are ignored; they still reach the main log file.
+    Records with a host context go to "<host>-<device>.log", so hosts
+    provisioning the same device path concurrently do not share a file.
+    """
+
+    def __init__(self, log_dir, level=logging.DEBUG):
+        super().__init__(level)
+        self.log_dir = log_dir
+        self._handlers = {}
+        os.makedirs(log_dir, exist_ok=True)
+
+    def emit(self, record):
+        device = getattr(record, "device", None)
+        if not device:
+            return
+        host = getattr(record, "host", None)
+        handler = self._handlers.get((host, device))
+        if handler is None:
+            name = os.path.basename(device)
+            if host:
+                name = f"{os.path.basename(str(host))}-{name}"
+            handler = logging.FileHandler(os.path.join(self.log_dir, f"{name}.log"))
+            handler.setFormatter(self.formatter)
+            self._handlers[(host, device)] = handler
+        handler.emit(record)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+        self._handlers.clear()
+        super().close()
+
+
+def _create_handler(kind, target):
+    if kind == "console":
+        # Console Handler with INFO level
+        handler = logging.StreamHandler()
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    elif kind == "file":
+        # File Handler with DEBUG level
+        handler = logging.FileHandler(target)
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    elif kind == "json":
+        handler = logging.FileHandler(target)
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(JsonLinesFormatter())
+    else:
+        handler = DeviceFileHandler(target)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def setup_logging(log_file:str="usb_encryption.log", json_log_file:str=None, device_log_dir:str=None):
     """
     Set up logging configuration for the USBEncryption module.
 
+    Records are put on a queue by a single QueueHandler and written by a
+    QueueListener thread, so provisioning threads never block on log I/O.
+    Calling this again with the same arguments returns the configured logger
+    without adding handlers; different arguments replace the previous outputs.
+
     Args:
         log_file (str): The path to the log file. Defaults to "usb_encryption.log".
+        json_log_file (str, optional): Path of an additional JSON-lines log including context fields.
+        device_log_dir (str, optional): Directory for per-device log files.
 
     Returns:
         logging.Logger: The configured logger object.
     """
 
-    logger = logging.getLogger("USBEncryption")
+    logger = logging.getLogger(LOGGER_NAME)
     logger.setLevel(logging.DEBUG)
 
-    # Console Handler with INFO level
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_format = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    console_handler.setFormatter(console_format)
+    wanted = [("console", None), ("file", os.path.abspath(log_file))]
+    if json_log_file:
+        wanted.append(("json", os.path.abspath(json_log_file)))
+    if device_log_dir:
+        wanted.append(("device_dir", os.path.abspath(device_log_dir)))
+
+    with _lock:
+        if _state["listener"] is not None and list(_state["handlers"]) == wanted:
+            return logger
+
+        if _state["listener"] is not None:
+            _state["listener"].stop()
+
+        handlers = {}
+        for key in wanted:
+            handlers[key] = _state["handlers"].pop(key, None) or _create_handler(*key)
+        for handler in _state["handlers"].values():
+            handler.close()
+        _state["handlers"] = handlers
+
+        if _state["queue_handler"] is None:
+            queue_handler = ContextQueueHandler(queue.SimpleQueue())
+            queue_handler.addFilter(ContextFilter())
+            logger.addHandler(queue_handler)
+            _state["queue_handler"] = queue_handler
+        if not _state["atexit"]:
+            atexit.register(shutdown_logging)
+            _state["atexit"] = True
+
+        listener = logging.handlers.QueueListener(
+            _state["queue_handler"].queue, *handlers.values(), respect_handler_level=True
+        )
+        listener.start()
+        _state["listener"] = listener
 
-    # File Handler with DEBUG level
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.DEBUG)
-    file_format = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(file_format)
+    return logger
 
-    # Add both handlers to the logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
 
-    return logger
\ No newline at end of file
+def shutdown_logging():
+    """Flush pending records, stop the listener thread and close all handlers."""
+    with _lock:
+        if _state["listener"] is not None:
+            _state["listener"].stop()
+            _state["listener"] = None
+        for handler in _state["handlers"].values():
+            handler.close()
+        _state["handlers"] = {}
+        if _state["queue_handler"] is not None:
+            logging.getLogger(LOGGER_NAME).removeHandler(_state["queue_handler"])
+            _state["queue_handler"] = None
@@ -0,0 +1,40 @@
+import os
+from .base import path_exists, make_dirs, luks_open, luks_close, mount_device
+
+# Function to open a LUKS partition using the key file; returns the mapped device
+def open_luks_partition(partition, key_file, logger):
+    luks_partition_name = f"luks-{os.path.basename(partition)}"
+    luks_mapped_device = f"/dev/mapper/{luks_partition_name}"
+
+    # Check if the LUKS device is already open and close it if necessary
+    if path_exists(luks_mapped_device):
+        logger.info(f"LUKS device {luks_partition_name} is already open. Closing it first.")
+        luks_close(luks_partition_name, logger)
+
+    logger.info(f"Decrypting {partition} using key file {key_file}")
+
+    # Open the LUKS partition
+    luks_open(partition, luks_partition_name, key_file, logger)
+    return luks_mapped_device
+
+# Function to mount an opened LUKS partition below the mount directory
+def mount_luks_partition(partition, mount_dir, logger):
+    luks_partition_name = f"luks-{os.path.basename(partition)}"
+    luks_mapped_device = f"/dev/mapper/{luks_partition_name}"
+
+    # Ensure the mount directory exists
+    mount_path = os.path.join(mount_dir, luks_partition_name)
+    if not path_exists(mount_path):
+        logger.info(f"Creating mount directory: {mount_path}")
+        make_dirs(mount_path)
+
+    # Mount the LUKS partition to the specified directory
+    mount_device(luks_mapped_device, mount_path, logger)
+    logger.info(f"LUKS partition {partition} mounted at {mount_path}")
+
+    return mount_path
+
+# Function to decrypt and mount a partition using the key file
+def decrypt_and_mount_partition(partition, key_file, mount_dir, logger):
+    open_luks_partition(partition, key_file, logger)
+    return mount_luks_partition(partition, mount_dir, logger)
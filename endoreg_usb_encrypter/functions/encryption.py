@@ -1,41 +1,40 @@
 import os
 import secrets
-from .base import run_command
+from .base import path_exists, make_dirs, write_key_file, luks_format, luks_open, luks_uuid, make_ext4, mount_device
 
 # Function to encrypt partition with LUKS
-def encrypt_partition(partition, mount_dir, key_dir, logger):
+def encrypt_partition(partition, mount_dir, key_dir, logger, on_progress=None):
     logger.info(f"Encrypting partition {partition} with LUKS")    
 
     # Generate a unique key file name for each partition
     key_file = f"{key_dir}/key-{os.path.basename(partition)}.key"
-    with open(key_file, "wb") as keyf:
-        key = secrets.token_bytes(32)  # 32 bytes = 256-bit key
-        keyf.write(key)
+    key = secrets.token_bytes(32)  # 32 bytes = 256-bit key
+    write_key_file(key_file, key, logger)
 
     # Encrypt the partition with LUKS
-    run_command(f"cryptsetup luksFormat {partition} {key_file} -q", logger)
+    luks_format(partition, key_file, logger)
     
     # Open the LUKS partition
     luks_partition_name = f"luks-{os.path.basename(partition)}"
-    run_command(f"cryptsetup open {partition} {luks_partition_name} --key-file={key_file}", logger)
+    luks_open(partition, luks_partition_name, key_file, logger)
 
     # Format the LUKS-mapped device with ext4
     luks_mapped_device = f"/dev/mapper/{luks_partition_name}"
     logger.info(f"Formatting LUKS-mapped device {luks_mapped_device} as ext4")
-    run_command(f"mkfs.ext4 {luks_mapped_device}", logger)
+    make_ext4(luks_mapped_device, logger, on_progress=on_progress, progress_label=partition)
 
     # Ensure the mount directory exists
     mount_path = os.path.join(mount_dir, luks_partition_name)
-    if not os.path.exists(mount_path):
+    if not path_exists(mount_path):
         logger.info(f"Creating mount directory: {mount_path}")
-        os.makedirs(mount_path)
+        make_dirs(mount_path)
     
     # Mount the LUKS partition to the specified directory
-    run_command(f"mount {luks_mapped_device} {mount_path}", logger)
+    mount_device(luks_mapped_device, mount_path, logger)
     logger.info(f"LUKS partition {partition} mounted at {mount_path}")
 
     # Get the LUKS UUID
-    luks_uuid = run_command(f"cryptsetup luksUUID {partition}", logger)
-    logger.info(f"LUKS partition {partition} opened as {luks_partition_name}, LUKS UUID: {luks_uuid}")
+    partition_luks_uuid = luks_uuid(partition, logger)
+    logger.info(f"LUKS partition {partition} opened as {luks_partition_name}, LUKS UUID: {partition_luks_uuid}")
     
-    return luks_uuid, key_file
\ No newline at end of file
+    return partition_luks_uuid, key_file
\ No newline at end of file
@@ -0,0 +1,130 @@
+# File system health checks of opened LUKS volumes before they are mounted
+import contextvars
+import os
+import struct
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import filesystem_state, fsck_preen, get_privileged_helper, use_privileged_helper
+from .custom_logging import log_context
+from .metrics import FSCK_DURATION
+
+# ext4 superblock layout (see linux/fs/ext4/ext4.h)
+SUPERBLOCK_OFFSET = 1024
+SUPERBLOCK_SIZE = 1024
+EXT4_MAGIC = 0xEF53
+MAGIC_OFFSET = 0x38
+STATE_OFFSET = 0x3A
+FEATURE_INCOMPAT_OFFSET = 0x60
+STATE_VALID = 0x0001
+STATE_ERROR = 0x0002
+INCOMPAT_RECOVER = 0x0004
+
+
+class FilesystemCheckError(RuntimeError):
+    """Raised when volumes fail the file system check; carries the check results."""
+
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+
+# Function to read the state of an ext4 file system from its superblock
+def read_ext4_state(device):
+    """
+    Read the ext4 superblock of `device` without running any tool.
+
+    Returns:
+        dict: "clean" (unmounted cleanly), "errors" (the kernel recorded errors)
+        and "needs_recovery" (the journal has to be replayed).
+
+    Raises:
+        ValueError: If `device` does not contain an ext4 file system.
+    """
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        superblock = os.pread(fd, SUPERBLOCK_SIZE, SUPERBLOCK_OFFSET)
+    finally:
+        os.close(fd)
+    if len(superblock) < SUPERBLOCK_SIZE or struct.unpack_from("<H", superblock, MAGIC_OFFSET)[0] != EXT4_MAGIC:
+        raise ValueError(f"{device} does not contain an ext4 file system")
+
+    state = struct.unpack_from("<H", superblock, STATE_OFFSET)[0]
+    incompat = struct.unpack_from("<I", superblock, FEATURE_INCOMPAT_OFFSET)[0]
+    return {
+        "clean": bool(state & STATE_VALID),
+        "errors": bool(state & STATE_ERROR),
+        "needs_recovery": bool(incompat & INCOMPAT_RECOVER),
+    }
+
+
+def _output(error):
+    # Tools run locally or remotely give bytes, the privileged helper gives str (stderr only)
+    streams = [stream.decode("utf-8", "replace") if isinstance(stream, bytes) else stream for stream in (error.stdout, error.stderr)]
+    return "\n".join(stream.strip() for stream in streams if stream and stream.strip()) or "no output"
+
+
+# Function to check the file system of a single volume
+def check_filesystem(device, logger):
+    """
+    Check the file system on `device`, skipping e2fsck if the superblock shows it is clean.
+
+    Returns:
+        dict: "device", "passed", "method" ("superblock" or "e2fsck"), the e2fsck
+        "exit_code" (None if skipped), the superblock "state" (None if it could
+        not be read) and the "duration" in seconds.
+    """
+    start = time.perf_counter()
+    result = {"device": device, "passed": False, "method": "superblock", "exit_code": None, "state": None}
+
+    try:
+        result["state"] = filesystem_state(device, logger)
+    except (OSError, ValueError) as e:
+        logger.debug(f"Could not read the superblock of {device}: {e}")
+
+    state = result["state"]
+    if state and state["clean"] and not state["errors"] and not state["needs_recovery"]:
+        logger.info(f"{device} is clean, skipping e2fsck")
+        result["passed"] = True
+    else:
+        logger.info(f"Checking {device} with e2fsck (superblock state: {state})")
+        result["method"] = "e2fsck"
+        try:
+            result["exit_code"] = fsck_preen(device, logger)
+            result["passed"] = True
+        except subprocess.CalledProcessError as e:
+            result["exit_code"] = e.returncode
+            logger.error(f"File system check of {device} failed with exit code {e.returncode}: {_output(e)}")
+
+    result["duration"] = round(time.perf_counter() - start, 3)
+    FSCK_DURATION.observe(result["duration"], method=result["method"])
+    return result
+
+
+# Function to check the file systems of several volumes in parallel
+def check_filesystems(devices, logger, max_workers=None):
+    """
+    Check the file systems on `devices` in parallel, one worker per device by default.
+
+    The workers run in copies of the caller's context, so the executor,
+    privileged helper and log context in use apply to every check. With the
+    helper, each worker opens its own connection, since one connection
+    handles a single request at a time.
+
+    Returns:
+        dict: Result of check_filesystem per device, in the order of `devices`.
+    """
+    def check(device):
+        with log_context(partition=device, step="check"):
+            helper = get_privileged_helper()
+            if helper is None:
+                return check_filesystem(device, logger)
+            with helper.connect() as client, use_privileged_helper(client):
+                return check_filesystem(device, logger)
+
+    if not devices:
+        return {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(devices)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, check, device) for device in devices]
+        return {device: future.result() for device, future in zip(devices, futures)}
@@ -0,0 +1,293 @@
+# Metrics of provisioning runs and mount state in the Prometheus text format
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+STEP_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 1800, 3600)
+COMMAND_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120, 600, 1800)
+ATTACH_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """A gauge that is either set explicitly or computed by `function` at collection time."""
+    kind = "gauge"
+
+    def __init__(self, registry, name, documentation, labelnames=(), function=None):
+        super().__init__(registry, name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def collect(self):
+        if self.function is not None:
+            try:
+                items = [((), self.function())]
+            except OSError:
+                return []
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=STEP_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(bound))])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def exposition(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+def _open_luks_mappings():
+    return sum(1 for name in os.listdir("/dev/mapper") if name.startswith("luks-"))
+
+
+def _luks_mounts():
+    from .block_devices import read_mounts
+    return sum(1 for source, _ in read_mounts() if source.startswith("/dev/mapper/luks-"))
+
+
+REGISTRY = Registry()
+
+RUNS = Counter(REGISTRY, "usb_encrypter_runs_total", "Provisioning runs by result.", ["result"])
+STEP_FAILURES = Counter(REGISTRY, "usb_encrypter_step_failures_total", "Failed provisioning steps.", ["step"])
+STEP_DURATION = Histogram(REGISTRY, "usb_encrypter_step_duration_seconds", "Duration of provisioning steps.", ["step"], STEP_BUCKETS)
+COMMAND_DURATION = Histogram(REGISTRY, "usb_encrypter_command_duration_seconds", "Duration of executed commands by tool.", ["command"], COMMAND_BUCKETS)
+BYTES_FORMATTED = Counter(REGISTRY, "usb_encrypter_bytes_formatted_total", "Bytes formatted with ext4.")
+FSCK_DURATION = Histogram(REGISTRY, "usb_encrypter_filesystem_check_duration_seconds", "Duration of file system checks before mounting, by method.", ["method"], COMMAND_BUCKETS)
+ATTACH_DURATION = Histogram(REGISTRY, "usb_encrypter_attach_duration_seconds", "Time to decrypt and mount all partitions of a device.", (), ATTACH_BUCKETS)
+LUKS_MAPPINGS = Gauge(REGISTRY, "usb_encrypter_luks_open_mappings", "Currently open LUKS mappings (/dev/mapper/luks-*).", function=_open_luks_mappings)
+MOUNTS = Gauge(REGISTRY, "usb_encrypter_luks_mounts", "Currently mounted LUKS volumes.", function=_luks_mounts)
+
+
+def command_name(command):
+    """The tool a shell command or argument list runs, used as the `command` label (e.g. "mkfs.ext4")."""
+    parts = command.split() if isinstance(command, str) else command
+    return os.path.basename(parts[0]) if parts else ""
+
+
+@contextmanager
+def track_run():
+    """Count a provisioning run by its result."""
+    try:
+        yield
+    except BaseException:
+        RUNS.inc(result="failure")
+        raise
+    RUNS.inc(result="success")
+
+
+@contextmanager
+def track_step(step):
+    """Time a provisioning step and count it as failed if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STEP_FAILURES.inc(step=step)
+        raise
+    finally:
+        STEP_DURATION.observe(time.perf_counter() - start, step=step)
+
+
+def record_formatted(device):
+    """Add the size of a freshly formatted local block device to the formatted bytes."""
+    name = os.path.basename(os.path.realpath(device))
+    try:
+        with open(f"/sys/class/block/{name}/size") as size_file:
+            BYTES_FORMATTED.inc(int(size_file.read()) * 512)
+    except (OSError, ValueError):
+        pass
+
+
+def _parse_value(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _read_cumulative(path):
+    """Counter and histogram samples of an existing textfile, as {family: {series: value}}."""
+    samples = {}
+    try:
+        with open(path) as metrics_file:
+            lines = metrics_file.read().splitlines()
+    except FileNotFoundError:
+        return samples
+    family = None
+    for line in lines:
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split()
+            family = name if kind in ("counter", "histogram") else None
+        elif line and not line.startswith("#") and family is not None:
+            series, _, value = line.rpartition(" ")
+            samples.setdefault(family, {})[series] = _parse_value(value)
+    return samples
+
+
+def _accumulate(lines, previous):
+    merged, family, cumulative = [], None, False
+
+    def keep_previous():
+        for series, value in previous.pop(family, {}).items():
+            merged.append(f"{series} {_format_value(value)}")
+
+    for line in lines:
+        if line.startswith("# HELP "):
+            keep_previous()
+            family = line.split()[2]
+        elif line.startswith("# TYPE "):
+            cumulative = line.split()[3] in ("counter", "histogram")
+        elif cumulative:
+            series, _, value = line.rpartition(" ")
+            line = f"{series} {_format_value(_parse_value(value) + previous.get(family, {}).pop(series, 0))}"
+        merged.append(line)
+    keep_previous()
+    return merged
+
+
+def write_textfile(path, registry=REGISTRY):
+    """
+    Write the metrics for the node-exporter textfile collector.
+
+    Each CLI run is a new process, so the counters and histograms of this run
+    are added to the values already in the file (series only found there are
+    kept); gauges are replaced. The directory is locked while the file is
+    merged, and the file is written next to `path` and renamed into place, so
+    the collector never reads a partially written file.
+    """
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        fcntl.flock(directory, fcntl.LOCK_EX)
+        lines = _accumulate(registry.exposition().splitlines(), _read_cumulative(path))
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n")
+        os.replace(temporary, path)
+    finally:
+        os.close(directory)
+
+
+def start_http_server(port, address="", registry=REGISTRY):
+    """Serve the metrics on http://address:port/metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
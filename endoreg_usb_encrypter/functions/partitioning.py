@@ -0,0 +1,27 @@
+from .base import make_partition_table, add_partition, make_ext4
+
+# Function to create partitions on the device
+def create_partitions(device, partition_names, size_factors, logger, on_progress=None):
+    logger.info(f"Creating partitions on {device} with partition names: {partition_names} and size factors: {size_factors}")
+    
+    # Run parted to clear existing partitions and inform the kernel of partition changes
+    make_partition_table(device, logger)
+
+    start = 1  # Start partitioning at 1% to avoid reserved space
+    partitions = []
+
+    for i, (name, factor) in enumerate(zip(partition_names, size_factors)):
+        end = start + factor * 100  # in percentage
+        partition = f"{device}{i+1}"
+        
+        # Create the partition with specified sizes and wait for the partition table to be updated
+        add_partition(device, name, start, end, logger)
+
+        # Format the partition as ext4, labeled with the provided name
+        make_ext4(partition, logger, label=name, on_progress=on_progress)
+
+        partitions.append(partition)
+        start = end
+    
+    logger.info(f"Partitions created, formatted, and labeled: {partitions}")
+    return partitions
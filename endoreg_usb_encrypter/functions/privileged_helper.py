@@ -0,0 +1,389 @@
+# Long-running privileged helper for root-only operations
+#
+# The helper runs as root and listens on a local unix socket. The unprivileged
+# front end keeps one connection open for the whole run and sends typed
+# requests (one JSON object per line); there is no way to run arbitrary
+# commands. Mounting, unmounting and reading device state are done with direct
+# syscalls and file reads; the remaining operations run the respective tool
+# without a shell or sudo in between.
+import ctypes
+import dataclasses
+import errno
+import grp
+import json
+import os
+import pwd
+import re
+import socket
+import stat
+import struct
+import subprocess
+import threading
+
+from .base import fsck_preen, stream_command
+from .block_devices import device_mounts, read_device_state, read_mounts
+from .filesystem_check import read_ext4_state
+from .metrics import COMMAND_DURATION, record_formatted
+from .progress import ProgressEvent
+
+DEFAULT_SOCKET_PATH = "/run/endoreg-usb-encrypter/helper.sock"
+DEFAULT_MOUNT_ROOTS = ("/mnt", "/media", "/run/media")
+# Key files are only accepted below explicitly configured directories
+DEFAULT_KEY_ROOTS = ()
+
+DEVICE_RE = re.compile(r"^/dev/[A-Za-z0-9_][A-Za-z0-9_./-]*$")
+NAME_RE = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]{0,63}$")
+KEY_FILE_RE = re.compile(r"^/[A-Za-z0-9_./+-]+$")
+
+# mount(2) flags (linux/mount.h); volumes hold data only, so helper mounts
+# ignore setuid bits and device nodes and do not allow execution
+MS_NOSUID = 0x2
+MS_NODEV = 0x4
+MS_NOEXEC = 0x8
+MOUNT_FLAGS = MS_NOSUID | MS_NODEV | MS_NOEXEC
+# umount2(2) flag: do not follow a symlink in the last component of the target
+UMOUNT_NOFOLLOW = 0x8
+
+# Operations that stream progress events to the client before their result
+PROGRESS_OPERATIONS = {"mkfs"}
+
+_libc = None
+
+
+def _syscall_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    return _libc
+
+
+def _raise_errno(message):
+    errno = ctypes.get_errno()
+    raise OSError(errno, f"{message}: {os.strerror(errno)}")
+
+
+def sys_mount(device, target, fstype="ext4", flags=MOUNT_FLAGS):
+    """Mount a device with the mount(2) syscall; by default without setuid binaries, device nodes and execution."""
+    if _syscall_libc().mount(device.encode(), target.encode(), fstype.encode(), ctypes.c_ulong(flags), None) != 0:
+        _raise_errno(f"mount {device} on {target}")
+
+
+def sys_umount(target, flags=UMOUNT_NOFOLLOW):
+    """Unmount a mount point with the umount2(2) syscall; by default without following a symlink at the target."""
+    if _syscall_libc().umount2(target.encode(), flags) != 0:
+        _raise_errno(f"umount {target}")
+
+
+def is_block_device(path):
+    """Whether `path` is a block device node (and not e.g. a regular file cryptsetup would loop-attach)."""
+    try:
+        return stat.S_ISBLK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def run_tool(argv):
+    """Run a tool without a shell and return its stripped stdout. Raises CalledProcessError."""
+    with COMMAND_DURATION.time(command=argv[0]):
+        result = subprocess.run(argv, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return result.stdout.decode("utf-8").strip()
+
+
+def run_parted(device, *arguments):
+    """Change the partition table with parted and let the kernel re-read it."""
+    run_tool(["parted", "-s", device, *arguments])
+    run_tool(["partprobe", device])
+
+
+def run_mkfs(device, logger, label=None, on_progress=None):
+    stream_command(["mkfs.ext4", device], logger, on_progress=on_progress, label=device)
+    if label:
+        run_tool(["e2label", device, label])
+    record_formatted(device)
+
+
+class PrivilegedHelperServer:
+    """
+    Serves the typed privileged operations to authorized local clients.
+
+    Clients are authenticated once per connection via SO_PEERCRED: the peer's
+    uid must be in `allowed_uids` or the peer must be a member of `allowed_group`.
+    Devices must be block devices that are not mounted outside of
+    `mount_roots`, mount and directory targets are restricted to `mount_roots`,
+    key files to `key_roots`. Tools are run with argument lists, never through
+    a shell.
+    """
+
+    def __init__(self, logger, socket_path=DEFAULT_SOCKET_PATH, allowed_uids=(), allowed_group=None, mount_roots=DEFAULT_MOUNT_ROOTS, key_roots=DEFAULT_KEY_ROOTS):
+        self.logger = logger
+        self.socket_path = socket_path
+        self.allowed_uids = set(allowed_uids)
+        self.allowed_gid = grp.getgrnam(allowed_group).gr_gid if allowed_group else None
+        self.mount_roots = [os.path.realpath(root) for root in mount_roots]
+        self.key_roots = [os.path.realpath(root) for root in key_roots]
+        self._socket = None
+
+        # Operation name -> (argument types, handler)
+        log = self.logger
+        self.operations = {
+            "device_state": ({"device": "device"}, read_device_state),
+            "make_dirs": ({"path": "mount_path"}, lambda path: os.makedirs(path, exist_ok=True)),
+            "mount": ({"device": "device", "mount_path": "mount_path"}, self.mount),
+            "umount": ({"target": "target"}, self.unmount),
+            "open_luks": ({"device": "device", "name": "name", "key_file": "key_file"}, lambda device, name, key_file: run_tool(["cryptsetup", "open", device, name, f"--key-file={key_file}"])),
+            "close_luks": ({"name": "name"}, lambda name: run_tool(["cryptsetup", "close", name])),
+            "format_luks": ({"device": "device", "key_file": "key_file"}, lambda device, key_file: run_tool(["cryptsetup", "luksFormat", device, key_file, "-q"])),
+            "luks_uuid": ({"device": "device"}, lambda device: run_tool(["cryptsetup", "luksUUID", device])),
+            "make_partition_table": ({"device": "device"}, lambda device: run_parted(device, "mklabel", "gpt")),
+            "add_partition": ({"device": "device", "name": "name", "start": "percent", "end": "percent"}, lambda device, name, start, end: run_parted(device, "mkpart", name, "ext4", f"{start}%", f"{end}%")),
+            "reread_partitions": ({"device": "device"}, lambda device: run_tool(["partprobe", device])),
+            "mkfs": ({"device": "device", "label": "label"}, lambda device, label=None, on_progress=None: run_mkfs(device, log, label=label, on_progress=on_progress)),
+            "filesystem_uuid": ({"device": "device"}, lambda device: run_tool(["blkid", "-s", "UUID", "-o", "value", device])),
+            "filesystem_state": ({"device": "device"}, read_ext4_state),
+            "fsck": ({"device": "device"}, lambda device: fsck_preen(device, log)),
+        }
+
+    def _under_mount_root(self, path):
+        path = os.path.realpath(path)
+        return any(path == root or path.startswith(root + os.sep) for root in self.mount_roots)
+
+    def mount(self, device, mount_path):
+        """
+        Mount `device` on the directory `mount_path` (already resolved by validate).
+
+        The directory is opened without following symlinks and mounted through
+        its /proc/self/fd link, so swapping a checked path for a symlink (e.g.
+        to /etc) before mount(2) runs has no effect.
+        """
+        fd = os.open(mount_path, os.O_PATH | os.O_NOFOLLOW | os.O_DIRECTORY)
+        try:
+            fd_path = f"/proc/self/fd/{fd}"
+            if not self._under_mount_root(os.readlink(fd_path)):
+                raise PermissionError(f"Path {mount_path!r} is outside of the allowed mount roots")
+            sys_mount(device, fd_path)
+        finally:
+            os.close(fd)
+
+    def unmount(self, target):
+        """Unmount a mount point, or every mount point of a device (umount2 only accepts mount points)."""
+        if not DEVICE_RE.match(target):
+            sys_umount(target)
+            return
+        mount_points = [mount_point for source, mount_point in read_mounts() if source == target]
+        if not mount_points:
+            raise OSError(errno.EINVAL, f"{target} is not mounted")
+        outside = [mount_point for mount_point in mount_points if not self._under_mount_root(mount_point)]
+        if outside:
+            raise PermissionError(f"{target} is mounted outside of the allowed mount roots: {', '.join(outside)}")
+        for mount_point in reversed(mount_points):
+            sys_umount(mount_point)
+
+    def _under_key_root(self, path):
+        path = os.path.realpath(path)
+        return any(path.startswith(root + os.sep) for root in self.key_roots)
+
+    def _check_device(self, device):
+        if not (DEVICE_RE.match(device) and ".." not in device and is_block_device(device)):
+            raise ValueError(f"Invalid device (must be a block device below /dev): {device!r}")
+        # Refuse the disks the system runs from, including through their partitions and mappings
+        outside = [mount_point for mount_point in device_mounts(device) if not self._under_mount_root(mount_point)]
+        if outside:
+            raise PermissionError(f"{device} is mounted outside of the allowed mount roots: {', '.join(outside)}")
+
+    def validate(self, operation, args):
+        """
+        Check a request against the operation's argument types and resolve its paths in place.
+
+        Raises ValueError, or PermissionError for devices in use by the system.
+        """
+        if operation not in self.operations:
+            raise ValueError(f"Unknown operation '{operation}'")
+        types, _ = self.operations[operation]
+        unexpected = set(args) - set(types)
+        if unexpected:
+            raise ValueError(f"Unexpected arguments for '{operation}': {sorted(unexpected)}")
+        for name, kind in types.items():
+            value = args.get(name)
+            if kind == "label":
+                if value is not None and not NAME_RE.match(str(value)):
+                    raise ValueError(f"Invalid label: {value!r}")
+                continue
+            if value is None:
+                raise ValueError(f"Missing argument '{name}' for '{operation}'")
+            if kind != "percent" and not isinstance(value, str):
+                raise ValueError(f"Argument '{name}' must be a string")
+            if kind == "device":
+                self._check_device(value)
+            if kind == "name" and not NAME_RE.match(value):
+                raise ValueError(f"Invalid name: {value!r}")
+            if kind == "percent" and not (isinstance(value, int) and 0 <= value <= 100):
+                raise ValueError(f"Invalid percentage: {value!r}")
+            if kind == "key_file" and not (KEY_FILE_RE.match(value) and self._under_key_root(value) and os.path.isfile(value)):
+                raise ValueError(f"Invalid key file (must be a file below the key roots): {value!r}")
+            if kind == "mount_path" and not self._under_mount_root(value):
+                raise ValueError(f"Path {value!r} is outside of the allowed mount roots")
+            if kind == "target" and not (self._under_mount_root(value) or DEVICE_RE.match(value)):
+                raise ValueError(f"Invalid unmount target: {value!r}")
+            # Hand the checked, resolved path to the handler rather than the client's
+            if kind == "mount_path" or (kind == "target" and not DEVICE_RE.match(value)):
+                args[name] = os.path.realpath(value)
+
+    @staticmethod
+    def parse(line):
+        """Split a request line into the operation and its arguments. Raises ValueError."""
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Invalid request: {e}") from None
+        if not (isinstance(request, dict) and isinstance(request.get("op"), str) and isinstance(request.get("args", {}), dict)):
+            raise ValueError('Invalid request: expected {"op": <name>, "args": {...}}')
+        return request["op"], request.get("args", {})
+
+    def authorize(self, connection):
+        pid, uid, gid = struct.unpack("3i", connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+        if uid in self.allowed_uids:
+            return uid
+        if self.allowed_gid is not None:
+            try:
+                user = pwd.getpwuid(uid)
+            except KeyError:
+                user = None
+            if gid == self.allowed_gid or (user and self.allowed_gid in os.getgrouplist(user.pw_name, gid)):
+                return uid
+        raise PermissionError(f"Peer uid {uid} (pid {pid}) is not allowed to use the privileged helper")
+
+    def handle(self, connection):
+        with connection, connection.makefile("rwb", buffering=0) as stream:
+            try:
+                uid = self.authorize(connection)
+            except PermissionError as e:
+                self.logger.warning(str(e))
+                stream.write(self._error(e))
+                return
+            self.logger.info(f"Privileged helper session opened for uid {uid}")
+
+            for line in stream:
+                operation = None
+                try:
+                    operation, args = self.parse(line)
+                    self.validate(operation, args)
+                    _, handler = self.operations[operation]
+                    if operation in PROGRESS_OPERATIONS:
+                        args["on_progress"] = lambda event: stream.write(self._encode({"progress": dataclasses.asdict(event)}))
+                    response = {"ok": True, "result": handler(**args)}
+                except Exception as e:
+                    self.logger.error(f"Privileged operation '{operation}' failed: {e}")
+                    stream.write(self._error(e))
+                    continue
+                stream.write(self._encode(response))
+            self.logger.info(f"Privileged helper session closed for uid {uid}")
+
+    @staticmethod
+    def _encode(message):
+        return (json.dumps(message) + "\n").encode("utf-8")
+
+    def _error(self, error):
+        response = {"ok": False, "error": type(error).__name__, "message": str(error)}
+        if isinstance(error, subprocess.CalledProcessError):
+            stderr = error.stderr.decode("utf-8", "replace") if isinstance(error.stderr, bytes) else error.stderr
+            response.update(returncode=error.returncode, cmd=error.cmd, stderr=stderr)
+        elif isinstance(error, OSError):
+            response.update(errno=error.errno, message=error.strerror or str(error))
+        return self._encode(response)
+
+    def serve_forever(self, socket_group=None):
+        """Listen on the socket and handle each client connection in its own thread."""
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        if socket_group:
+            os.chown(self.socket_path, -1, grp.getgrnam(socket_group).gr_gid)
+        self._socket.listen()
+        self.logger.info(f"Privileged helper listening on {self.socket_path}")
+
+        try:
+            while True:
+                try:
+                    connection, _ = self._socket.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+class PrivilegedHelperClient:
+    """
+    Connection of the unprivileged front end to the privileged helper.
+
+    One connection (and thus one authentication) is used for the whole run;
+    install it with `use_privileged_helper` to route the privileged operations.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        self.socket_path = socket_path
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._stream = self._socket.makefile("rwb", buffering=0)
+        self._lock = threading.Lock()
+
+    def call(self, operation, on_progress=None, **args):
+        """
+        Run an operation in the helper and return its result.
+
+        Raises the error the operation raised in the helper: CalledProcessError
+        for failing tools, OSError for failing syscalls, ValueError for rejected
+        requests and PermissionError if the client is not authorized.
+        """
+        with self._lock:
+            self._stream.write((json.dumps({"op": operation, "args": args}) + "\n").encode("utf-8"))
+            while True:
+                line = self._stream.readline()
+                if not line:
+                    raise ConnectionError("Privileged helper closed the connection")
+                response = json.loads(line)
+                if "progress" not in response:
+                    break
+                if on_progress is not None:
+                    on_progress(ProgressEvent(**response["progress"]))
+
+        if response["ok"]:
+            return response["result"]
+        error = response["error"]
+        if error == "CalledProcessError":
+            raise subprocess.CalledProcessError(response["returncode"], response["cmd"], stderr=response["stderr"])
+        if error == "PermissionError":
+            raise PermissionError(response["message"])
+        if error == "ValueError":
+            raise ValueError(response["message"])
+        if "errno" in response:
+            raise OSError(response["errno"], response["message"])
+        raise RuntimeError(f"{error}: {response['message']}")
+
+    def connect(self):
+        """Open another connection to the same helper, e.g. for a worker thread."""
+        return PrivilegedHelperClient(self.socket_path)
+
+    def device_state(self, device):
+        return self.call("device_state", device=device)
+
+    def close(self):
+        self._stream.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
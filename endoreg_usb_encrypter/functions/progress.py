@@ -0,0 +1,117 @@
+# Parsing of progress reports printed by long-running tools (mkfs.ext4)
+import re
+import time
+from dataclasses import dataclass, field
+
+# mkfs.ext4 prints "Writing inode tables:  3/120" and then rewrites the counter
+# in place with backspaces, so the label is only printed once per stage.
+MKFS_STAGE_RE = re.compile(r"^(?P<stage>[A-Z][A-Za-z ]+?):\s*(?P<done>\d+)/(?P<total>\d+)\s*$")
+MKFS_COUNTER_RE = re.compile(r"^\s*(?P<done>\d+)/(?P<total>\d+)\s*$")
+
+TOKEN_SEPARATORS_RE = re.compile(r"[\r\n\b]+")
+
+
+@dataclass
+class ProgressEvent:
+    """
+    A single progress report of a running command.
+
+    Attributes:
+        label (str): What the command works on (usually the device or partition).
+        stage (str): The tool's current stage, e.g. "Writing inode tables".
+        percent (float): Completion of the stage in percent.
+        eta_seconds (float | None): Estimated time until the stage completes.
+    """
+    label: str
+    stage: str
+    percent: float
+    eta_seconds: float | None = None
+    timestamp: float = field(default_factory=time.time)
+
+
+class ProgressParser:
+    """
+    Incremental parser for the output stream of a single command.
+
+    Output is fed in arbitrary chunks; complete tokens (separated by newlines,
+    carriage returns or backspaces) are parsed into ProgressEvent objects.
+    Tokens that carry no progress are returned as plain output lines.
+    """
+
+    def __init__(self, label, clock=time.monotonic):
+        self.label = label
+        self.clock = clock
+        self._buffer = ""
+        self._stage = None
+        self._stage_started = None
+        self._stage_complete = False
+
+    def feed(self, text):
+        """
+        Feed a chunk of decoded output.
+
+        Returns:
+            tuple[list[ProgressEvent], list[str]]: Parsed events and non-progress output lines.
+        """
+        self._buffer += text
+        tokens = TOKEN_SEPARATORS_RE.split(self._buffer)
+        self._buffer = tokens.pop()
+        return self._parse_tokens(tokens)
+
+    def flush(self):
+        """Parse whatever is left in the buffer once the stream is closed."""
+        tokens = [self._buffer] if self._buffer else []
+        self._buffer = ""
+        return self._parse_tokens(tokens)
+
+    def _parse_tokens(self, tokens):
+        events, lines = [], []
+        for token in tokens:
+            if not token.strip():
+                continue
+            if self._stage_complete and self._stage and token.strip() == "done":
+                # The counter already reported 100%; only end the stage
+                self._stage = None
+                continue
+            event = self.parse_token(token)
+            if event is None:
+                lines.append(token.strip())
+            else:
+                events.append(event)
+        return events, lines
+
+    def parse_token(self, token):
+        match = MKFS_STAGE_RE.match(token.strip())
+        if match:
+            self._stage = match["stage"]
+            self._stage_started = self.clock()
+            self._stage_complete = False
+            return self._counter_event(int(match["done"]), int(match["total"]))
+
+        match = MKFS_COUNTER_RE.match(token)
+        if match and self._stage:
+            return self._counter_event(int(match["done"]), int(match["total"]))
+
+        # Anything else ends a counter stage; mkfs reports completion with "done"
+        event = None
+        if self._stage and token.strip() == "done":
+            event = ProgressEvent(label=self.label, stage=self._stage, percent=100.0, eta_seconds=0.0)
+        self._stage = None
+        return event
+
+    def _counter_event(self, done, total):
+        percent = 100.0 * done / total if total else 100.0
+        self._stage_complete = percent >= 100.0
+        eta = None
+        elapsed = self.clock() - self._stage_started
+        if done and elapsed > 0:
+            eta = elapsed * (total - done) / done
+        return ProgressEvent(label=self.label, stage=self._stage, percent=percent, eta_seconds=eta)
+
+
+def format_progress(event):
+    """Render a progress event as a single human-readable line."""
+    text = f"[{event.label}] {event.stage}: {event.percent:5.1f}%"
+    if event.eta_seconds is not None:
+        text += f", ETA {int(event.eta_seconds) // 60:02d}:{int(event.eta_seconds) % 60:02d}"
+    return text
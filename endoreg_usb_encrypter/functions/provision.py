@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+
+from .base import format_partition
+from .cleanup import cleanup_device
+from .partitioning import create_partitions
+from .custom_logging import log_context
+from .encryption import encrypt_partition
+from .metrics import track_run, track_step
+from .remounting import unmount_and_mount_all_partitions
+from .throughput import require_local_probes, verify_throughput
+
+
+# Function to write the Nix configuration file
+def write_nix_configuration(hdd_info, partition_names, nix_file="sensitive-hdd.nix"):
+    nix_content = []
+
+    nix_content.append("{ ... }:\n")
+    nix_content.append("let\n")
+    nix_content.append("  sensitive-hdd = {\n")
+
+    for i, partition in enumerate(hdd_info["partitions"]):
+        p_name = partition_names[i]
+        nix_content.append(f"    # Partition {p_name}\n")
+        nix_content.append(f"    \"{p_name}\" = {{\n")
+        nix_content.append(f"      label = \"{p_name}\";\n")
+        nix_content.append(f"      device = \"/dev/disk/by-uuid/{partition['uuid']}\";\n")
+        nix_content.append(f"      device-by-label = \"/dev/disk/by-label/{p_name}\";\n")
+        nix_content.append(f"      mountPoint = \"/mnt/sensitive-hdd-mount/{p_name}\";\n")
+        nix_content.append(f"      uuid = \"{partition['uuid']}\";\n")
+        nix_content.append(f"      luks-uuid = \"{partition['luks_uuid']}\";\n")
+        nix_content.append(f"      luks-device = \"/dev/disk/by-uuid/{partition['luks_uuid']}\";\n")
+        nix_content.append(f"      fsType = \"ext4\";\n")
+        nix_content.append("    };\n")
+
+    nix_content.append("  };\n")
+    nix_content.append("in sensitive-hdd")
+
+    # Write to file
+    with open(nix_file, "w") as nix_file_obj:
+        nix_file_obj.write("".join(nix_content))
+
+    print(f"Nix configuration file written to {nix_file}")
+
+
+# Function to create a directory and set its owner and permissions
+def prepare_directory(path, user, group, logger, mode=0o770):
+    if not os.path.exists(path):
+        logger.info(f"Creating directory: {path}")
+        os.makedirs(path)
+
+    logger.info(f"Setting permissions for directory: {path}")
+    shutil.chown(path, user=user, group=group)
+    os.chmod(path, mode)
+    logger.info(f"Permissions ({oct(mode)}) set for {path}: user={user}, group={group}")
+
+
+# Function to run the full provisioning pipeline on a device
+def provision_device(
+        device,
+        partition_names,
+        size_factors,
+        mount_dir,
+        key_dir,
+        logger,
+        output_json="output.json",
+        hdd_info_json="hdd-info.json",
+        nix_output_file="sensitive-hdd.nix",
+        on_progress=None,
+        probe_size=None,
+        min_write_mbps=None,
+        min_read_mbps=None,
+        fail_below_floor=True
+    ):
+    """
+    Partition, encrypt and format a device, write the result files and test remounting.
+
+    Args:
+        device (str): The device to provision, e.g. "/dev/sdb".
+        partition_names (list[str]): Names (labels) of the partitions.
+        size_factors (list[float]): Relative partition sizes, summing to 1.
+        mount_dir (str): Directory the LUKS partitions are mounted below.
+        key_dir (str): Directory the key files are written to.
+        logger (logging.Logger): The logger.
+        output_json (str): Path of the partition/UUID summary.
+        hdd_info_json (str): Path of the HDD info including encryption details.
+        nix_output_file (str): Path of the generated Nix configuration.
+        on_progress (callable, optional): Receives ProgressEvent objects of long-running commands.
+        probe_size (int, optional): If set, verify the throughput of the volumes with probes of this many bytes.
+            Only supported for local devices without the privileged helper.
+        min_write_mbps (float, optional): Sequential write floor in MiB/s for the throughput verification.
+        min_read_mbps (float, optional): Sequential read floor in MiB/s for the throughput verification.
+        fail_below_floor (bool): Raise if a volume is below the floor instead of only flagging it.
+
+    Returns:
+        dict: The HDD info record.
+    """
+    # Refuse throughput probes before touching the device if they cannot run here
+    if probe_size:
+        require_local_probes()
+
+    with log_context(device=device), track_run():
+        # Step 1: Cleanup device before partitioning
+        with log_context(step="cleanup"), track_step("cleanup"):
+            cleanup_device(device, mount_dir, logger)
+
+        # Step 2: Create partitions
+        with log_context(step="partition"), track_step("partition"):
+            partitions = create_partitions(device, partition_names, size_factors, logger, on_progress=on_progress)
+
+        # Initialize storage for results
+        result = {
+            "partitions": [],
+        }
+        hdd_info = {
+            "device": device,
+            "partitions": []
+        }
+
+        # Step 3: Format partitions with ext4 and encrypt them with LUKS
+        for partition in partitions:
+            with log_context(partition=partition, step="encrypt"), track_step("encrypt"):
+                partition_uuid = format_partition(partition, logger, on_progress=on_progress)
+                luks_uuid, key_file = encrypt_partition(partition, mount_dir, key_dir, logger, on_progress=on_progress)
+            result["partitions"].append({"partition": partition, "uuid": partition_uuid})
+            hdd_info["partitions"].append({
+                "partition": partition,
+                "uuid": partition_uuid,
+                "luks_uuid": luks_uuid,
+                "encryption_key": key_file
+            })
+
+        # Step 4: Save partition output to JSON
+        with open(output_json, "w") as json_file:
+            json.dump(result, json_file, indent=4)
+        logger.info(f"Results written to {output_json}")
+
+        # Step 5: Save HDD info (including encryption details) to JSON
+        with open(hdd_info_json, "w") as hdd_json_file:
+            json.dump(hdd_info, hdd_json_file, indent=4)
+        logger.info(f"HDD Info written to {hdd_info_json}")
+
+        # Step 6: Write Nix configuration file
+        write_nix_configuration(hdd_info, partition_names, nix_output_file)
+
+        # Step 7: Test unmount and remount functionality
+        with log_context(step="verify"), track_step("verify"):
+            unmount_and_mount_all_partitions(device, mount_dir, logger, key_dir)
+
+        # Step 8: Verify the throughput of the volumes and record it in the HDD info
+        if probe_size:
+            try:
+                with track_step("throughput"):
+                    verify_throughput(
+                        hdd_info, mount_dir, logger,
+                        size=probe_size,
+                        min_write_mbps=min_write_mbps,
+                        min_read_mbps=min_read_mbps,
+                        fail_below_floor=fail_below_floor,
+                    )
+            finally:
+                with open(hdd_info_json, "w") as hdd_json_file:
+                    json.dump(hdd_info, hdd_json_file, indent=4)
+                logger.info(f"Throughput results written to {hdd_info_json}")
+
+    return hdd_info
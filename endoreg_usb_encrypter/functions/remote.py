@@ -0,0 +1,213 @@
+# Remote execution of the provisioning pipeline over pooled SSH connections
+import os
+import select
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+from .base import make_dirs, run_command, use_executor
+from .custom_logging import log_context
+from .provision import provision_device
+
+# Seconds between SSH keepalive packets on pooled connections
+KEEPALIVE_INTERVAL = 30
+
+
+class SSHConnectionPool:
+    """
+    Keeps one authenticated SSH connection per (host, port, username).
+
+    Every command opens a new channel on the shared transport, so a provisioning
+    run with dozens of commands authenticates only once per host. The pool is
+    thread-safe; connections to different hosts are established concurrently.
+    """
+
+    def __init__(self, host_key_policy=None, connect_kwargs=None):
+        self.host_key_policy = host_key_policy or paramiko.RejectPolicy()
+        self.connect_kwargs = connect_kwargs or {}
+        self._lock = threading.Lock()
+        self._host_locks = {}
+        self._clients = {}
+        self._sftp = {}
+
+    def _host_lock(self, key):
+        with self._lock:
+            return self._host_locks.setdefault(key, threading.Lock())
+
+    def client(self, host, port=22, username=None, **connect_kwargs):
+        """Return a connected SSHClient for the host, connecting on first use or after a drop."""
+        key = (host, port, username)
+        with self._host_lock(key):
+            client = self._clients.get(key)
+            transport = client.get_transport() if client is not None else None
+            if transport is not None and transport.is_active():
+                return client
+
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            client.set_missing_host_key_policy(self.host_key_policy)
+            client.connect(host, port=port, username=username, **{**self.connect_kwargs, **connect_kwargs})
+            client.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+            self._clients[key] = client
+            self._sftp.pop(key, None)
+            return client
+
+    def sftp(self, host, port=22, username=None, **connect_kwargs):
+        """Return an SFTP session on the pooled connection and a lock guarding its use."""
+        client = self.client(host, port, username, **connect_kwargs)
+        key = (host, port, username)
+        with self._host_lock(key):
+            if key not in self._sftp:
+                self._sftp[key] = (client.open_sftp(), threading.Lock())
+            return self._sftp[key]
+
+    def close(self):
+        with self._lock:
+            for sftp, _ in self._sftp.values():
+                sftp.close()
+            for client in self._clients.values():
+                client.close()
+            self._sftp.clear()
+            self._clients.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SSHExecutor:
+    """
+    Runs commands and file operations on a remote host through an SSHConnectionPool.
+
+    Use it with `use_executor` to run any of the provisioning functions remotely.
+    Key files are written to the remote host over SFTP on the pooled connection
+    and, if `key_store` is set, also stored centrally in `key_store/<host>/`.
+    """
+
+    def __init__(self, host, pool, port=22, username=None, key_store=None, **connect_kwargs):
+        self.host = host
+        self.pool = pool
+        self.port = port
+        self.username = username
+        self.key_store = key_store
+        self.connect_kwargs = connect_kwargs
+
+    def run(self, command, check=False, on_output=None):
+        """
+        Run a shell command on the remote host.
+
+        Args:
+            command (str): The shell command.
+            check (bool): Raise CalledProcessError on a non-zero exit status.
+            on_output (callable, optional): Receives ("stdout" | "stderr", bytes) chunks as they
+                arrive, followed by an empty chunk per stream. Output is then not accumulated.
+
+        Returns:
+            subprocess.CompletedProcess: With bytes stdout/stderr (None when streaming).
+        """
+        client = self.pool.client(self.host, self.port, self.username, **self.connect_kwargs)
+        channel = client.get_transport().open_session()
+        buffers = {"stdout": [], "stderr": []}
+        emit = on_output or (lambda name, chunk: buffers[name].append(chunk))
+        try:
+            channel.exec_command(command)
+            readers = {"stdout": channel.recv, "stderr": channel.recv_stderr}
+            ready = {"stdout": channel.recv_ready, "stderr": channel.recv_stderr_ready}
+            open_streams = ["stdout", "stderr"]
+            while open_streams:
+                select.select([channel], [], [], 1.0)
+                for name in list(open_streams):
+                    while ready[name]():
+                        emit(name, readers[name](32768))
+                    if (channel.eof_received or channel.closed) and not ready[name]():
+                        emit(name, b"")
+                        open_streams.remove(name)
+            returncode = channel.recv_exit_status()
+        finally:
+            channel.close()
+
+        stdout = None if on_output else b"".join(buffers["stdout"])
+        stderr = None if on_output else b"".join(buffers["stderr"])
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, output=stdout, stderr=stderr)
+        return subprocess.CompletedProcess(command, returncode, stdout, stderr)
+
+    def path_exists(self, path):
+        return self.run(f"test -e {shlex.quote(path)}").returncode == 0
+
+    def is_mount(self, path):
+        return self.run(f"mountpoint -q {shlex.quote(path)}").returncode == 0
+
+    def make_dirs(self, path, mode=None):
+        command = f"mkdir -p {shlex.quote(path)}"
+        if mode is not None:
+            command += f" && chmod {mode:o} {shlex.quote(path)}"
+        self.run(command, check=True)
+
+    def write_key_file(self, key_file, key):
+        sftp, lock = self.pool.sftp(self.host, self.port, self.username, **self.connect_kwargs)
+        with lock:
+            with sftp.open(key_file, "wb") as remote_file:
+                remote_file.chmod(0o600)
+                remote_file.write(key)
+
+        if self.key_store:
+            host_dir = os.path.join(self.key_store, self.host)
+            os.makedirs(host_dir, mode=0o700, exist_ok=True)
+            local_key_file = os.path.join(host_dir, os.path.basename(key_file))
+            with open(os.open(local_key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as keyf:
+                keyf.write(key)
+
+
+# Function to provision devices on several hosts concurrently
+def provision_hosts(jobs, logger, pool=None, key_store=None, max_workers=None):
+    """
+    Run `provision_device` for several remote hosts in parallel.
+
+    Args:
+        jobs (list[dict]): One dict per device with "host" and the `provision_device`
+            arguments (device, partition_names, size_factors, mount_dir, key_dir, ...).
+            Optional "port" and "username" select the SSH account, optional
+            "key_dir_owner" ("user:group") the owner of the remote key directory.
+        logger (logging.Logger): The logger.
+        pool (SSHConnectionPool, optional): Pool to use; a new one is created and closed otherwise.
+        key_store (str, optional): Central directory the key files are copied to.
+        max_workers (int, optional): Maximum number of devices provisioned at once.
+
+    Returns:
+        list: The hdd-info record, or the raised exception, per job in input order.
+    """
+    own_pool = pool is None
+    pool = pool or SSHConnectionPool()
+
+    def run_job(job):
+        job = dict(job)
+        executor = SSHExecutor(job.pop("host"), pool, port=job.pop("port", 22), username=job.pop("username", None), key_store=key_store)
+        # Result files are written locally, so keep them apart per host and device
+        prefix = f"{executor.host}-{os.path.basename(job['device'])}"
+        job.setdefault("output_json", f"{prefix}-output.json")
+        job.setdefault("hdd_info_json", f"{prefix}-hdd-info.json")
+        job.setdefault("nix_output_file", f"{prefix}-sensitive-hdd.nix")
+        key_dir_owner = job.pop("key_dir_owner", None)
+        with use_executor(executor), log_context(host=executor.host):
+            try:
+                # Key files are written over SFTP, which does not create the directory
+                make_dirs(job["key_dir"], mode=0o700)
+                if key_dir_owner:
+                    run_command(f"chown {shlex.quote(key_dir_owner)} {shlex.quote(job['key_dir'])}", logger)
+                return provision_device(logger=logger, **job)
+            except Exception as e:
+                logger.error(f"Provisioning {job['device']} on {executor.host} failed: {e}")
+                return e
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers or len(jobs) or 1) as workers:
+            return list(workers.map(run_job, jobs))
+    finally:
+        if own_pool:
+            pool.close()
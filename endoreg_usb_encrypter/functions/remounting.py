@@ -0,0 +1,20 @@
+
+from .unmounting import unmount_partitions
+from .attach import attach_device
+
+
+# Function to test unmounting and remounting all partitions
+def unmount_and_mount_all_partitions(
+        device, mount_dir, 
+        logger,
+        key_dir
+    ):
+    logger.info("Testing unmount and remount of all partitions")
+
+    # Unmount all partitions
+    unmount_partitions(mount_dir, logger)
+
+    # Reuse the key files saved during encryption to remount the partitions
+    attach_device(device, mount_dir, key_dir, logger)
+
+    logger.info("Test completed: all partitions unmounted and remounted successfully.")
\ No newline at end of file
@@ -0,0 +1,243 @@
+# Throughput verification of provisioned drives
+import mmap
+import os
+import random
+import time
+
+from .base import get_executor, get_privileged_helper
+from .custom_logging import log_context
+
+MIB = 1024 * 1024
+DEFAULT_PROBE_SIZE = 64 * MIB
+DEFAULT_BLOCK_SIZE = 1 * MIB
+RANDOM_BLOCK_SIZE = 4096
+RANDOM_OPERATIONS = 256
+PROBE_FILE_NAME = ".endoreg-throughput-probe"
+
+
+class ThroughputBelowFloorError(RuntimeError):
+    """Raised when a drive does not reach the configured throughput floor."""
+
+
+def _open(path, flags, direct):
+    # O_DIRECT bypasses the page cache; fall back to buffered I/O where the
+    # file system does not support it (e.g. tmpfs)
+    if direct:
+        try:
+            return os.open(path, flags | os.O_DIRECT, 0o600), True
+        except OSError:
+            pass
+    return os.open(path, flags, 0o600), False
+
+
+def _drop_cache(fd):
+    os.fsync(fd)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _mbps(size, seconds):
+    return round(size / MIB / seconds, 2) if seconds > 0 else None
+
+
+def _random_offsets(span, count, seed=0):
+    blocks = max(span // RANDOM_BLOCK_SIZE, 1)
+    rng = random.Random(seed)
+    return [rng.randrange(blocks) * RANDOM_BLOCK_SIZE for _ in range(count)]
+
+
+def _sequential_read(fd, size, block_size):
+    buffer = mmap.mmap(-1, block_size)
+    start = time.perf_counter()
+    done = 0
+    while done < size:
+        read = os.preadv(fd, [buffer], done)
+        if read <= 0:
+            break
+        done += read
+    return _mbps(done, time.perf_counter() - start)
+
+
+def _random_io(fd, span, count, write=False):
+    buffer = mmap.mmap(-1, RANDOM_BLOCK_SIZE)
+    if write:
+        buffer.write(os.urandom(RANDOM_BLOCK_SIZE))
+    offsets = _random_offsets(span, count)
+    start = time.perf_counter()
+    for offset in offsets:
+        if write:
+            os.pwritev(fd, [buffer], offset)
+        else:
+            os.preadv(fd, [buffer], offset)
+    if write:
+        os.fsync(fd)
+    return _mbps(count * RANDOM_BLOCK_SIZE, time.perf_counter() - start)
+
+
+# Function to measure read/write throughput in a mounted file system
+def probe_volume(mount_path, size=DEFAULT_PROBE_SIZE, block_size=DEFAULT_BLOCK_SIZE, direct=True):
+    """
+    Run sequential and random read/write probes on a temporary file below `mount_path`.
+
+    Args:
+        mount_path (str): Mount point of the volume.
+        size (int): Bytes written and read sequentially; rounded down to whole blocks.
+        block_size (int): Block size of the sequential probes.
+        direct (bool): Use O_DIRECT; falls back to buffered I/O if unsupported.
+
+    Returns:
+        dict: Throughput in MiB/s (seq_write, seq_read, rand_write, rand_read) and whether O_DIRECT was used.
+    """
+    size = max(size // block_size, 1) * block_size
+    probe_file = os.path.join(mount_path, PROBE_FILE_NAME)
+    buffer = mmap.mmap(-1, block_size)
+    buffer.write(os.urandom(block_size))
+
+    fd, used_direct = _open(probe_file, os.O_RDWR | os.O_CREAT | os.O_TRUNC, direct)
+    try:
+        start = time.perf_counter()
+        for offset in range(0, size, block_size):
+            os.pwritev(fd, [buffer], offset)
+        os.fsync(fd)
+        seq_write = _mbps(size, time.perf_counter() - start)
+
+        # Make sure reads come from the device, not from the page cache
+        _drop_cache(fd)
+        seq_read = _sequential_read(fd, size, block_size)
+        rand_write = _random_io(fd, size, RANDOM_OPERATIONS, write=True)
+        _drop_cache(fd)
+        rand_read = _random_io(fd, size, RANDOM_OPERATIONS)
+    finally:
+        os.close(fd)
+        os.unlink(probe_file)
+
+    return {
+        "seq_write": seq_write,
+        "seq_read": seq_read,
+        "rand_write": rand_write,
+        "rand_read": rand_read,
+        "direct": used_direct,
+        "size": size,
+    }
+
+
+# Function to measure read throughput of a raw block device
+def probe_device_read(device, size=DEFAULT_PROBE_SIZE, block_size=DEFAULT_BLOCK_SIZE, direct=True):
+    """
+    Run read-only sequential and random probes on a raw device. Never writes to it.
+
+    Returns:
+        dict: Throughput in MiB/s (seq_read, rand_read) and whether O_DIRECT was used.
+    """
+    fd, used_direct = _open(device, os.O_RDONLY, direct)
+    try:
+        device_size = os.lseek(fd, 0, os.SEEK_END)
+        size = max(min(size, device_size) // block_size, 1) * block_size
+        if not used_direct:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        seq_read = _sequential_read(fd, size, block_size)
+        rand_read = _random_io(fd, device_size, RANDOM_OPERATIONS)
+    finally:
+        os.close(fd)
+    return {"seq_read": seq_read, "rand_read": rand_read, "direct": used_direct, "size": size}
+
+
+# Function to make sure the throughput probes can run in this process
+def require_local_probes():
+    """
+    Raise ValueError if a remote executor or the privileged helper is in use.
+
+    The probes open the volumes and raw partitions directly from this process,
+    so on a remote host they would measure the wrong machine, and behind the
+    helper they lack the privileges to read the partitions.
+    """
+    if get_executor() is not None:
+        raise ValueError("Throughput probes cannot run on a remote host")
+    if get_privileged_helper() is not None:
+        raise ValueError("Throughput probes cannot run through the privileged helper")
+
+
+def _below_floor(results, min_write_mbps, min_read_mbps):
+    reasons = []
+    if min_write_mbps is not None and results["seq_write"] is not None and results["seq_write"] < min_write_mbps:
+        reasons.append(f"sequential write {results['seq_write']} MiB/s < {min_write_mbps} MiB/s")
+    if min_read_mbps is not None and results["seq_read"] is not None and results["seq_read"] < min_read_mbps:
+        reasons.append(f"sequential read {results['seq_read']} MiB/s < {min_read_mbps} MiB/s")
+    return reasons
+
+
+# Function to verify the throughput of all LUKS volumes of a provisioned device
+def verify_throughput(
+        hdd_info,
+        mount_dir,
+        logger,
+        size=DEFAULT_PROBE_SIZE,
+        min_write_mbps=None,
+        min_read_mbps=None,
+        compare_buffered=True,
+        fail_below_floor=True
+    ):
+    """
+    Probe every mounted LUKS volume and its raw partition and record the results in `hdd_info`.
+
+    Each partition record gets a "throughput" entry with the direct (and
+    optionally buffered) volume probes, the raw partition read probe, the
+    encryption overhead (relative loss of sequential read throughput) and
+    whether it stayed below the floor. The device record gets a summary.
+
+    Args:
+        hdd_info (dict): The HDD info record written during provisioning; updated in place.
+        mount_dir (str): Directory the LUKS volumes are mounted below.
+        logger (logging.Logger): The logger.
+        size (int): Probe size in bytes.
+        min_write_mbps (float, optional): Sequential write floor in MiB/s.
+        min_read_mbps (float, optional): Sequential read floor in MiB/s.
+        compare_buffered (bool): Also run buffered probes for comparison.
+        fail_below_floor (bool): Raise ThroughputBelowFloorError instead of only flagging the drive.
+
+    Returns:
+        dict: The updated HDD info record.
+    """
+    require_local_probes()
+    device = hdd_info["device"]
+    failures = []
+
+    with log_context(device=device, step="throughput"):
+        for partition_info in hdd_info["partitions"]:
+            partition = partition_info["partition"]
+            mount_path = os.path.join(mount_dir, f"luks-{os.path.basename(partition)}")
+            with log_context(partition=partition):
+                logger.info(f"Probing throughput of {mount_path} ({size // MIB} MiB)")
+                results = {"direct": probe_volume(mount_path, size)}
+                if compare_buffered:
+                    results["buffered"] = probe_volume(mount_path, size, direct=False)
+                results["raw"] = probe_device_read(partition, size)
+
+                raw_read = results["raw"]["seq_read"]
+                luks_read = results["direct"]["seq_read"]
+                results["encryption_overhead"] = round(1 - luks_read / raw_read, 3) if raw_read and luks_read else None
+
+                reasons = _below_floor(results["direct"], min_write_mbps, min_read_mbps)
+                results["below_floor"] = bool(reasons)
+                partition_info["throughput"] = results
+
+                logger.info(
+                    f"{partition}: write {results['direct']['seq_write']} MiB/s, read {luks_read} MiB/s, "
+                    f"raw read {raw_read} MiB/s, encryption overhead {results['encryption_overhead']}"
+                )
+                for reason in reasons:
+                    logger.warning(f"{partition} below throughput floor: {reason}")
+                    failures.append(f"{partition}: {reason}")
+
+        volumes = [p["throughput"]["direct"] for p in hdd_info["partitions"]]
+        hdd_info["throughput"] = {
+            "probe_size": size,
+            "min_seq_write": min((v["seq_write"] for v in volumes if v["seq_write"] is not None), default=None),
+            "min_seq_read": min((v["seq_read"] for v in volumes if v["seq_read"] is not None), default=None),
+            "min_write_mbps": min_write_mbps,
+            "min_read_mbps": min_read_mbps,
+            "below_floor": bool(failures),
+        }
+
+    if failures and fail_below_floor:
+        raise ThroughputBelowFloorError(f"{device} is below the throughput floor: {'; '.join(failures)}")
+    return hdd_info
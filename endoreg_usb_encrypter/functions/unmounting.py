@@ -1,5 +1,5 @@
 # Function to unmount all partitions
-from .base import run_command
+from .base import run_command, unmount
 
 def unmount_partitions(mount_dir, logger):
     logger.info(f"Unmounting all LUKS partitions from {mount_dir}")
@@ -17,6 +17,6 @@ def unmount_partitions(mount_dir, logger):
         
         if mountpoint:
             logger.info(f"Unmounting {luks_device} from {mountpoint}")
-            run_command(f"umount {mountpoint}", logger)
+            unmount(mountpoint, logger)
     
     logger.info("All partitions unmounted.")
\ No newline at end of file
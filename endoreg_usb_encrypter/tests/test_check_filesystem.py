@@ -0,0 +1,90 @@
+import struct
+import subprocess
+import pytest
+from endoreg_usb_encrypter.functions import FilesystemCheckError, attach_device, read_ext4_state, use_executor
+from endoreg_usb_encrypter.functions.base import fsck_preen, get_executor
+
+
+def _image(tmp_path, state, incompat=0, magic=0xEF53):
+    """Write a file containing an ext4 superblock with the given state and incompatible features."""
+    superblock = bytearray(1024)
+    struct.pack_into("<H", superblock, 0x38, magic)
+    struct.pack_into("<H", superblock, 0x3A, state)
+    struct.pack_into("<I", superblock, 0x60, incompat)
+    image = tmp_path / f"image-{state}-{incompat}-{magic}"
+    image.write_bytes(bytes(1024) + bytes(superblock))
+    return str(image)
+
+
+def test_read_ext4_state(tmp_path):
+    """
+    Test that a clean unmount, recorded errors and a pending journal recovery are read from the superblock.
+    """
+    assert read_ext4_state(_image(tmp_path, state=0x1)) == {"clean": True, "errors": False, "needs_recovery": False}
+    assert read_ext4_state(_image(tmp_path, state=0x3)) == {"clean": True, "errors": True, "needs_recovery": False}
+    assert read_ext4_state(_image(tmp_path, state=0x1, incompat=0x4 | 0x40)) == {"clean": True, "errors": False, "needs_recovery": True}
+    with pytest.raises(ValueError):
+        read_ext4_state(_image(tmp_path, state=0x1, magic=0))
+
+
+def test_attach_device_mounts_only_volumes_that_pass(mocker):
+    """
+    Test that clean volumes skip e2fsck, dirty ones are checked in the caller's context and failed ones are not mounted.
+    """
+    executor = mocker.Mock()
+    states = {
+        "/dev/mapper/luks-sdx1": {"clean": True, "errors": False, "needs_recovery": False},
+        "/dev/mapper/luks-sdx2": {"clean": True, "errors": False, "needs_recovery": True},
+        "/dev/mapper/luks-sdx3": {"clean": False, "errors": True, "needs_recovery": False},
+    }
+    checked = []
+
+    def fake_fsck(device, logger):
+        checked.append((device, get_executor()))
+        if device.endswith("3"):
+            raise subprocess.CalledProcessError(returncode=4, cmd=f"e2fsck -p {device}", output=b"", stderr=b"e2fsck: Bad magic number in super-block")
+        return 1
+
+    mocker.patch("endoreg_usb_encrypter.functions.attach.list_partitions", return_value=["sdx1", "sdx2", "sdx3"])
+    mock_open = mocker.patch("endoreg_usb_encrypter.functions.attach.open_luks_partition", side_effect=lambda p, k, l: f"/dev/mapper/luks-{p[5:]}")
+    mock_mount = mocker.patch("endoreg_usb_encrypter.functions.attach.mount_luks_partition", side_effect=lambda p, m, l: f"{m}/luks-{p[5:]}")
+    mocker.patch("endoreg_usb_encrypter.functions.filesystem_check.filesystem_state", side_effect=lambda device, logger: states[device])
+    mocker.patch("endoreg_usb_encrypter.functions.filesystem_check.fsck_preen", side_effect=fake_fsck)
+
+    mock_logger = mocker.Mock()
+    with use_executor(executor), pytest.raises(FilesystemCheckError) as excinfo:
+        attach_device("/dev/sdx", "/mnt", "/keys", mock_logger)
+    mock_logger.error.assert_any_call("File system check of /dev/mapper/luks-sdx3 failed with exit code 4: e2fsck: Bad magic number in super-block")
+
+    assert mock_open.call_count == 3
+    mock_open.assert_any_call("/dev/sdx2", "/keys/key-sdx2.key", mocker.ANY)
+    assert [c.args[0] for c in mock_mount.call_args_list] == ["/dev/sdx1", "/dev/sdx2"]
+    assert sorted(checked) == [("/dev/mapper/luks-sdx2", executor), ("/dev/mapper/luks-sdx3", executor)]
+
+    results = excinfo.value.results
+    assert [(r["passed"], r["method"], r["exit_code"]) for r in results.values()] == [
+        (True, "superblock", None),
+        (True, "e2fsck", 1),
+        (False, "e2fsck", 4),
+    ]
+    assert all(r["duration"] >= 0 for r in results.values())
+
+
+def test_fsck_preen_corrected_errors_are_not_failures(mocker):
+    """
+    Test that e2fsck exit codes 1 and 2 are returned without logging an error, and 4 raises.
+    """
+    mock_subprocess_run = mocker.patch("subprocess.run")
+    mock_logger = mocker.Mock()
+
+    mock_subprocess_run.return_value.returncode = 1
+    mock_subprocess_run.return_value.stdout = b"/dev/mapper/luks-sdx1: 11/65536 files, Inode 12 ref count fixed"
+    mock_subprocess_run.return_value.stderr = b""
+    assert fsck_preen("/dev/mapper/luks-sdx1", mock_logger) == 1
+    mock_logger.debug.assert_called_once_with("e2fsck output for /dev/mapper/luks-sdx1: /dev/mapper/luks-sdx1: 11/65536 files, Inode 12 ref count fixed")
+    mock_subprocess_run.assert_called_once_with(["e2fsck", "-p", "/dev/mapper/luks-sdx1"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    mock_subprocess_run.return_value.returncode = 4
+    with pytest.raises(subprocess.CalledProcessError):
+        fsck_preen("/dev/mapper/luks-sdx1", mock_logger)
+    mock_logger.error.assert_not_called()
@@ -0,0 +1,42 @@
+import json
+from endoreg_usb_encrypter.functions import cleanup_device
+from endoreg_usb_encrypter.functions.block_devices import parse_lsblk
+
+
+def test_parse_lsblk():
+    """
+    Test that lsblk JSON output gives the partitions, LUKS mappings and mounts of a device.
+    """
+    output = json.dumps({"blockdevices": [{"name": "sdb", "type": "disk", "mountpoint": None, "children": [
+        {"name": "sdb1", "type": "part", "mountpoint": None, "children": [
+            {"name": "luks-sdb1", "type": "crypt", "mountpoint": "/mnt/luks-sdb1"},
+        ]},
+        {"name": "sdb2", "type": "part", "mountpoint": "/media/usb"},
+    ]}]})
+
+    assert parse_lsblk(output) == {
+        "partitions": ["sdb1", "sdb2"],
+        "luks": {"sdb1": "luks-sdb1"},
+        "mounts": {"/dev/mapper/luks-sdb1": ["/mnt/luks-sdb1"], "/dev/sdb2": ["/media/usb"]},
+    }
+
+
+def test_cleanup_device_unmounts_mount_points(mocker):
+    """
+    Test that cleanup unmounts mount points rather than devices and closes only the device's mappings.
+    """
+    mocker.patch("endoreg_usb_encrypter.functions.cleanup.device_state", return_value={
+        "partitions": ["sdb1", "sdb2"],
+        "luks": {"sdb1": "luks-sdb1"},
+        "mounts": {"/dev/mapper/luks-sdb1": ["/mnt/luks-sdb1"], "/dev/sdb2": ["/media/usb"]},
+    })
+    mock_unmount = mocker.patch("endoreg_usb_encrypter.functions.cleanup.unmount")
+    mock_luks_close = mocker.patch("endoreg_usb_encrypter.functions.cleanup.luks_close")
+    mock_reread = mocker.patch("endoreg_usb_encrypter.functions.cleanup.reread_partitions")
+    logger = mocker.Mock()
+
+    cleanup_device("/dev/sdb", "/mnt", logger)
+
+    assert [c.args[0] for c in mock_unmount.call_args_list] == ["/mnt/luks-sdb1", "/media/usb"]
+    mock_luks_close.assert_called_once_with("luks-sdb1", logger)
+    mock_reread.assert_called_once_with("/dev/sdb", logger)
@@ -0,0 +1,145 @@
+import os
+import subprocess
+import sys
+from endoreg_usb_encrypter import cli
+
+
+def _loaded_modules(*argv):
+    code = (
+        "import sys\n"
+        "from endoreg_usb_encrypter import cli\n"
+        f"cli.main({list(argv)!r}) if {bool(argv)!r} else None\n"
+        "print(' '.join(sorted(m for m in sys.modules if m.startswith('endoreg_usb_encrypter.functions.'))))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.PIPE)
+    return result.stdout.decode("utf-8").split()
+
+
+def test_cli_import_is_lazy():
+    """
+    Test that importing the CLI does not import any of the function modules.
+    """
+    assert _loaded_modules() == []
+
+
+def test_cli_list_imports_only_what_it_needs():
+    """
+    Test that the startup path of `list` only loads the base, logging and metrics modules.
+    """
+    assert _loaded_modules("--import-only", "list") == [
+        "endoreg_usb_encrypter.functions.base",
+        "endoreg_usb_encrypter.functions.custom_logging",
+        "endoreg_usb_encrypter.functions.metrics",
+    ]
+
+
+def test_cli_import_only_rejects_unknown_commands(capsys):
+    """
+    Test that --import-only without a subcommand or with an unknown one exits with a usage error.
+    """
+    assert cli.main(["--import-only"]) == 2
+    assert cli.main(["--import-only", "format-everything"]) == 2
+    assert "usage: --import-only" in capsys.readouterr().err
+
+
+def test_cli_provision_unattended(mocker, tmp_path):
+    """
+    Test that `provision --yes` takes every prompt from flags without calling input().
+    """
+    mock_input = mocker.patch("builtins.input")
+    mock_prepare = mocker.patch("endoreg_usb_encrypter.functions.provision.prepare_directory")
+    mock_provision = mocker.patch("endoreg_usb_encrypter.functions.provision.provision_device")
+    mock_logger = mocker.Mock()
+    mocker.patch("endoreg_usb_encrypter.cli._logger", return_value=mock_logger)
+
+    exit_code = cli.main([
+        "provision",
+        "--device", "/dev/sdx",
+        "--partition-names", "a,b,c",
+        "--sizes", "50,25,25",
+        "--mount-dir", str(tmp_path / "mnt"),
+        "--key-dir", str(tmp_path / "keys"),
+        "--yes",
+    ])
+
+    assert exit_code == 0
+    mock_input.assert_not_called()
+    assert mock_prepare.call_count == 2
+    mock_provision.assert_called_once_with(
+        "/dev/sdx",
+        ["a", "b", "c"],
+        [0.5, 0.25, 0.25],
+        str(tmp_path / "mnt"),
+        str(tmp_path / "keys"),
+        mock_logger,
+        output_json="output.json",
+        hdd_info_json="hdd-info.json",
+        nix_output_file="sensitive-hdd.nix",
+        probe_size=None,
+        min_write_mbps=None,
+        min_read_mbps=None,
+        fail_below_floor=True,
+    )
+
+
+def test_cli_provision_unattended_requires_device(mocker):
+    """
+    Test that unattended provisioning refuses to guess the device.
+    """
+    mock_provision = mocker.patch("endoreg_usb_encrypter.functions.provision.provision_device")
+    mocker.patch("endoreg_usb_encrypter.cli._logger", return_value=mocker.Mock())
+
+    assert cli.main(["provision", "--yes"]) == 2
+    mock_provision.assert_not_called()
+
+
+def test_cli_provision_interactive_requires_device(mocker):
+    """
+    Test that an empty device answer ends the interactive provisioning.
+    """
+    mocker.patch("builtins.input", return_value="")
+    mocker.patch("endoreg_usb_encrypter.functions.base.list_devices")
+    mock_provision = mocker.patch("endoreg_usb_encrypter.functions.provision.provision_device")
+    mocker.patch("endoreg_usb_encrypter.cli._logger", return_value=mocker.Mock())
+
+    assert cli.main(["provision"]) == 2
+    mock_provision.assert_not_called()
+
+
+def test_lazy_exports_are_not_shadowed_by_submodules():
+    """
+    Test that importing the submodules does not replace the exported functions on the package.
+    """
+    import endoreg_usb_encrypter.functions.provision  # noqa: F401 - imports most other submodules
+    import endoreg_usb_encrypter.functions.attach as attach_module
+    from endoreg_usb_encrypter import functions
+    from endoreg_usb_encrypter.functions import attach_device, cleanup_device, device_state, verify_throughput
+
+    for function in (attach_device, cleanup_device, device_state, verify_throughput):
+        assert callable(function)
+        assert getattr(functions, function.__name__) is function
+    assert attach_module.attach_device is attach_device
+
+
+def test_legacy_main_translates_options():
+    """
+    Test that the options of the old main.py script map onto the CLI, with top-level options before `provision`.
+    """
+    from endoreg_usb_encrypter.main import legacy_argv
+
+    assert legacy_argv(["--logfile", "x.log", "--yes", "--factors", "0.5", "0.25", "0.25", "--mountdir", "/mnt/a", "--keydir", "keys", "--nixfile", "a.nix"]) == [
+        "--logfile", "x.log", "provision", "--sizes", "50,25,25", "--nixfile", "a.nix", "--mount-dir", "/mnt/a", "--key-dir", "keys", "--yes",
+    ]
+    assert cli.build_parser().parse_args(legacy_argv(["--logfile", "x.log", "--yes"])).logfile == "x.log"
+
+
+def test_legacy_main_runs_from_a_checkout(tmp_path):
+    """
+    Test that main.py runs as a plain script without the package being installed.
+    """
+    main_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+    # -S skips site-packages, where an installed copy of the package would be found
+    result = subprocess.run([sys.executable, "-S", main_path, "--help"], cwd=tmp_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    assert result.returncode == 0, result.stderr.decode("utf-8")
+    assert b"--mountdir" in result.stdout
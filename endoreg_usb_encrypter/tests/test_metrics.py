@@ -0,0 +1,99 @@
+import urllib.request
+import pytest
+from endoreg_usb_encrypter.functions import REGISTRY, run_command, start_http_server, write_textfile
+from endoreg_usb_encrypter.functions.metrics import COMMAND_DURATION, STEP_FAILURES, Counter, Gauge, Histogram, Registry, track_step
+
+
+def test_exposition_format():
+    """
+    Test that counters and histograms are rendered in the Prometheus text format.
+    """
+    registry = Registry()
+    runs = Counter(registry, "runs_total", "Runs.", ["result"])
+    duration = Histogram(registry, "duration_seconds", "Duration.", ["step"], buckets=(1, 5))
+    runs.inc(result='fa"il')
+    duration.observe(0.5, step="encrypt")
+    duration.observe(3, step="encrypt")
+
+    assert registry.exposition() == (
+        "# HELP runs_total Runs.\n"
+        "# TYPE runs_total counter\n"
+        'runs_total{result="fa\\"il"} 1\n'
+        "# HELP duration_seconds Duration.\n"
+        "# TYPE duration_seconds histogram\n"
+        'duration_seconds_bucket{step="encrypt",le="1"} 1\n'
+        'duration_seconds_bucket{step="encrypt",le="5"} 2\n'
+        'duration_seconds_bucket{step="encrypt",le="+Inf"} 2\n'
+        'duration_seconds_sum{step="encrypt"} 3.5\n'
+        'duration_seconds_count{step="encrypt"} 2\n'
+    )
+
+
+def test_commands_and_failed_steps_are_recorded(mocker):
+    """
+    Test that run_command records its duration by tool and a raising step counts as failed.
+    """
+    mocker.patch("subprocess.run").return_value.stdout = b"sdb"
+    before = STEP_FAILURES.value(step="cleanup")
+
+    with pytest.raises(RuntimeError):
+        with track_step("cleanup"):
+            run_command("/usr/bin/lsblk -d -o NAME", mocker.Mock())
+            raise RuntimeError("device busy")
+
+    assert STEP_FAILURES.value(step="cleanup") == before + 1
+    assert any(line.startswith('usb_encrypter_command_duration_seconds_count{command="lsblk"} ') for line in COMMAND_DURATION.collect())
+
+
+def test_textfile_and_http_endpoint(tmp_path):
+    """
+    Test that the textfile is written without leftovers and the endpoint serves the same metrics.
+    """
+    textfile = tmp_path / "endoreg.prom"
+    write_textfile(str(textfile))
+    assert [p.name for p in tmp_path.iterdir()] == ["endoreg.prom"]
+    assert "# TYPE usb_encrypter_runs_total counter" in textfile.read_text()
+
+    server = start_http_server(0, "127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            assert response.read().decode("utf-8") == REGISTRY.exposition()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_textfile_accumulates_across_runs(tmp_path):
+    """
+    Test that counters and histograms add up over several writes while gauges are replaced.
+    """
+    textfile = tmp_path / "endoreg.prom"
+    registry = Registry()
+    runs = Counter(registry, "runs_total", "Runs.", ["result"])
+    duration = Histogram(registry, "duration_seconds", "Duration.", buckets=(1,))
+    mappings = Gauge(registry, "open_mappings", "Mappings.")
+
+    runs.inc(result="failure")
+    duration.observe(0.5)
+    mappings.set(2)
+    write_textfile(str(textfile), registry)
+
+    # The next run is a new process with fresh metrics
+    registry = Registry()
+    runs = Counter(registry, "runs_total", "Runs.", ["result"])
+    duration = Histogram(registry, "duration_seconds", "Duration.", buckets=(1,))
+    mappings = Gauge(registry, "open_mappings", "Mappings.")
+    runs.inc(result="success")
+    duration.observe(2.0)
+    mappings.set(1)
+    write_textfile(str(textfile), registry)
+
+    lines = textfile.read_text().splitlines()
+    assert 'runs_total{result="failure"} 1' in lines
+    assert 'runs_total{result="success"} 1' in lines
+    assert 'duration_seconds_bucket{le="1"} 1' in lines
+    assert 'duration_seconds_bucket{le="+Inf"} 2' in lines
+    assert "duration_seconds_sum 2.5" in lines
+    assert "duration_seconds_count 2" in lines
+    assert "open_mappings 1" in lines
+    assert [p.name for p in tmp_path.iterdir()] == ["endoreg.prom"]
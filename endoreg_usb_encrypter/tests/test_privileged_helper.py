@@ -0,0 +1,275 @@
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+import pytest
+from endoreg_usb_encrypter.functions import (
+    PrivilegedHelperClient,
+    PrivilegedHelperServer,
+    ProgressEvent,
+    check_filesystems,
+    format_partition,
+    use_privileged_helper,
+)
+from endoreg_usb_encrypter.functions import privileged_helper
+
+HELPER_MODULE = "endoreg_usb_encrypter.functions.privileged_helper"
+
+
+@pytest.fixture
+def helper(mocker, tmp_path):
+    """Start a helper on a temporary socket; yields a function creating servers. /dev/sdx* and their mappings count as unmounted block devices."""
+    servers = []
+    real_is_block_device = privileged_helper.is_block_device
+    mocker.patch(f"{HELPER_MODULE}.is_block_device", side_effect=lambda path: path.startswith(("/dev/sdx", "/dev/mapper/luks-sdx")) or real_is_block_device(path))
+    mocker.patch(f"{HELPER_MODULE}.device_mounts", return_value=[])
+
+    def start(allowed_uids=(os.getuid(),)):
+        socket_path = str(tmp_path / f"helper-{len(servers)}.sock")
+        server = PrivilegedHelperServer(mocker.Mock(), socket_path=socket_path, allowed_uids=allowed_uids, mount_roots=[str(tmp_path)], key_roots=[str(tmp_path / "keys")])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        while not os.path.exists(socket_path):
+            time.sleep(0.01)
+        servers.append(server)
+        return socket_path
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_privileged_helper_reuses_session(mocker, helper, tmp_path):
+    """
+    Test that several operations run over one connection and progress events are forwarded.
+    """
+    def fake_stream_command(command, logger, on_progress=None, label=None):
+        assert command == ["mkfs.ext4", "/dev/sdx1"]
+        on_progress(ProgressEvent(label=label, stage="Writing inode tables", percent=50.0))
+        return ""
+
+    mocker.patch("endoreg_usb_encrypter.functions.privileged_helper.stream_command", side_effect=fake_stream_command)
+    mock_subprocess_run = mocker.patch("subprocess.run")
+    mock_subprocess_run.return_value.stdout = b"1234-abcd"
+    events = []
+
+    with PrivilegedHelperClient(helper()) as client, use_privileged_helper(client):
+        partition_uuid = format_partition("/dev/sdx1", mocker.Mock(), on_progress=events.append)
+        client.call("make_dirs", path=str(tmp_path / "mnt" / "luks-sdx1"))
+
+    assert partition_uuid == "1234-abcd"
+    assert events == [ProgressEvent(label="/dev/sdx1", stage="Writing inode tables", percent=50.0, timestamp=events[0].timestamp)]
+    mock_subprocess_run.assert_called_once_with(["blkid", "-s", "UUID", "-o", "value", "/dev/sdx1"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert (tmp_path / "mnt" / "luks-sdx1").is_dir()
+
+
+def test_privileged_helper_rejects_invalid_requests(mocker, helper):
+    """
+    Test that arguments outside the typed operation set are rejected.
+    """
+    mock_subprocess_run = mocker.patch("subprocess.run")
+
+    with PrivilegedHelperClient(helper()) as client:
+        with pytest.raises(ValueError):
+            client.call("mount", device="/dev/sdx1", mount_path="/etc")
+        with pytest.raises(ValueError):
+            client.call("close_luks", name="x; rm -rf /")
+        with pytest.raises(ValueError):
+            client.call("run", command="id")
+
+    mock_subprocess_run.assert_not_called()
+
+
+def test_privileged_helper_rejects_unsafe_key_files(mocker, helper, tmp_path):
+    """
+    Test that key files with shell metacharacters or outside the key roots are rejected and no tool runs.
+    """
+    (tmp_path / "keys").mkdir()
+    unsafe_key = tmp_path / "keys" / "k$(touch${IFS}PWNED)"
+    unsafe_key.write_bytes(b"secret")
+    outside_key = tmp_path / "key-sdx1.key"
+    outside_key.write_bytes(b"secret")
+    mock_subprocess_run = mocker.patch("subprocess.run")
+
+    with PrivilegedHelperClient(helper()) as client:
+        for key_file in (unsafe_key, outside_key, tmp_path / "keys" / ".." / "key-sdx1.key"):
+            with pytest.raises(ValueError):
+                client.call("open_luks", device="/dev/sdx1", name="luks-sdx1", key_file=str(key_file))
+
+    mock_subprocess_run.assert_not_called()
+    assert not (tmp_path / "keys" / "PWNED").exists()
+
+
+def test_privileged_helper_runs_tools_without_shell(mocker, helper, tmp_path):
+    """
+    Test that accepted key files are passed to cryptsetup as a single argument, without a shell.
+    """
+    (tmp_path / "keys").mkdir()
+    key_file = tmp_path / "keys" / "key-sdx1.key"
+    key_file.write_bytes(b"secret")
+    mock_subprocess_run = mocker.patch("subprocess.run")
+    mock_subprocess_run.return_value.stdout = b""
+
+    with PrivilegedHelperClient(helper()) as client:
+        client.call("open_luks", device="/dev/sdx1", name="luks-sdx1", key_file=str(key_file))
+
+    mock_subprocess_run.assert_called_once_with(
+        ["cryptsetup", "open", "/dev/sdx1", "luks-sdx1", f"--key-file={key_file}"],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+
+def test_privileged_helper_propagates_tool_errors(mocker, helper):
+    """
+    Test that a failing tool raises CalledProcessError in the client.
+    """
+    mocker.patch("subprocess.run", side_effect=subprocess.CalledProcessError(
+        returncode=4, cmd="cryptsetup close luks-sdx1", stderr=b"Device luks-sdx1 not found"
+    ))
+
+    with PrivilegedHelperClient(helper()) as client:
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            client.call("close_luks", name="luks-sdx1")
+
+    assert excinfo.value.returncode == 4
+    assert excinfo.value.stderr == "Device luks-sdx1 not found"
+
+
+def test_privileged_helper_rejects_unauthorized_peer(helper):
+    """
+    Test that peers not in the allowed users or group cannot use the helper.
+    """
+    with PrivilegedHelperClient(helper(allowed_uids=())) as client:
+        with pytest.raises(PermissionError):
+            client.call("close_luks", name="luks-sdx1")
+
+
+def test_privileged_helper_mounts_nosuid_nodev_noexec(mocker, helper, tmp_path):
+    """
+    Test that the helper mounts volumes with MS_NOSUID, MS_NODEV and MS_NOEXEC.
+    """
+    libc = mocker.Mock()
+    libc.mount.return_value = 0
+    mocker.patch("endoreg_usb_encrypter.functions.privileged_helper._syscall_libc", return_value=libc)
+    mount_path = tmp_path / "luks-sdx1"
+    mount_path.mkdir()
+
+    with PrivilegedHelperClient(helper()) as client:
+        client.call("mount", device="/dev/mapper/luks-sdx1", mount_path=str(mount_path))
+
+    device, target, fstype, flags, data = libc.mount.call_args.args
+    assert (device, fstype, data) == (b"/dev/mapper/luks-sdx1", b"ext4", None)
+    assert target.startswith(b"/proc/self/fd/")
+    assert flags.value == 0x2 | 0x4 | 0x8
+
+
+def test_privileged_helper_does_not_follow_swapped_symlinks(mocker, tmp_path):
+    """
+    Test that a mount directory replaced by a symlink after validation is neither mounted on nor unmounted.
+    """
+    libc = mocker.Mock()
+    mocker.patch(f"{HELPER_MODULE}._syscall_libc", return_value=libc)
+    mocker.patch(f"{HELPER_MODULE}.is_block_device", return_value=True)
+    mocker.patch(f"{HELPER_MODULE}.device_mounts", return_value=[])
+    server = PrivilegedHelperServer(mocker.Mock(), socket_path=str(tmp_path / "helper.sock"), mount_roots=[str(tmp_path)])
+    link = tmp_path / "luks-sdx1"
+    link.symlink_to("/etc")
+
+    with pytest.raises(OSError):
+        server.mount("/dev/mapper/luks-sdx1", str(link))
+    with pytest.raises(ValueError, match="outside of the allowed mount roots"):
+        server.validate("mount", {"device": "/dev/mapper/luks-sdx1", "mount_path": str(link)})
+
+    libc.umount2.return_value = 0
+    args = {"target": str(tmp_path / "mnt" / ".." / "luks-sdx2")}
+    server.validate("umount", args)
+    server.operations["umount"][1](**args)
+
+    libc.mount.assert_not_called()
+    libc.umount2.assert_called_once_with(str(tmp_path / "luks-sdx2").encode(), 0x8)
+
+
+def test_privileged_helper_unmounts_devices_by_mount_point(mocker, helper, tmp_path):
+    """
+    Test that a device target is unmounted at its mount points, and only below the mount roots.
+    """
+    libc = mocker.Mock()
+    libc.umount2.return_value = 0
+    mocker.patch("endoreg_usb_encrypter.functions.privileged_helper._syscall_libc", return_value=libc)
+    mocker.patch("endoreg_usb_encrypter.functions.privileged_helper.read_mounts", return_value=[
+        ("/dev/mapper/luks-sdx1", str(tmp_path / "luks-sdx1")),
+        ("/dev/sdx2", "/"),
+    ])
+
+    with PrivilegedHelperClient(helper()) as client:
+        client.call("umount", target="/dev/mapper/luks-sdx1")
+        with pytest.raises(PermissionError):
+            client.call("umount", target="/dev/sdx2")
+        with pytest.raises(OSError):
+            client.call("umount", target="/dev/sdx3")
+
+    assert [c.args[0] for c in libc.umount2.call_args_list] == [str(tmp_path / "luks-sdx1").encode()]
+
+
+def test_privileged_helper_checks_run_concurrently(mocker, helper):
+    """
+    Test that parallel file system checks each use their own helper connection instead of queueing on one.
+    """
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fake_read_ext4_state(device):
+        barrier.wait()
+        return {"clean": True, "errors": False, "needs_recovery": False}
+
+    mocker.patch("endoreg_usb_encrypter.functions.privileged_helper.read_ext4_state", side_effect=fake_read_ext4_state)
+
+    with PrivilegedHelperClient(helper()) as client, use_privileged_helper(client):
+        results = check_filesystems(["/dev/mapper/luks-sdx1", "/dev/mapper/luks-sdx2"], mocker.Mock())
+
+    assert [(r["passed"], r["method"]) for r in results.values()] == [(True, "superblock"), (True, "superblock")]
+
+
+def test_privileged_helper_rejects_non_block_devices(mocker, helper):
+    """
+    Test that device arguments must be block devices, so regular files are never loop-attached by cryptsetup.
+    """
+    mock_subprocess_run = mocker.patch("subprocess.run")
+
+    with PrivilegedHelperClient(helper()) as client:
+        for device in ("/dev/null", "/dev/shm/evil.img", "/dev/sdx1/../../etc/passwd"):
+            with pytest.raises(ValueError):
+                client.call("luks_uuid", device=device)
+
+    mock_subprocess_run.assert_not_called()
+
+
+def test_privileged_helper_rejects_devices_mounted_outside_mount_roots(mocker, helper, tmp_path):
+    """
+    Test that disks with a mount outside of the mount roots (e.g. the system disk) cannot be formatted.
+    """
+    mock_subprocess_run = mocker.patch("subprocess.run")
+    mock_device_mounts = mocker.patch(f"{HELPER_MODULE}.device_mounts", return_value=["/", str(tmp_path / "luks-sdx1")])
+
+    with PrivilegedHelperClient(helper()) as client:
+        with pytest.raises(PermissionError):
+            client.call("mkfs", device="/dev/sdx")
+
+    mock_device_mounts.assert_called_once_with("/dev/sdx")
+    mock_subprocess_run.assert_not_called()
+
+
+def test_privileged_helper_answers_malformed_requests(helper):
+    """
+    Test that invalid JSON and non-object requests get an error response and the session stays usable.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(helper())
+        stream = connection.makefile("rwb", buffering=0)
+        responses = []
+        for line in (b"not json\n", b"[1, 2]\n", b'{"op": "close_luks", "args": "luks-sdx1"}\n', b'{"op": "run"}\n'):
+            stream.write(line)
+            responses.append(json.loads(stream.readline()))
+        stream.close()
+
+    assert [(r["ok"], r["error"]) for r in responses] == [(False, "ValueError")] * 4
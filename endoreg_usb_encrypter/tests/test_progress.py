@@ -0,0 +1,64 @@
+import pytest
+import subprocess
+from endoreg_usb_encrypter.functions import ProgressParser, stream_command
+
+
+def test_progress_parser_mkfs_counter():
+    """
+    Test that mkfs counters rewritten with backspaces are parsed across chunks.
+    """
+    parser = ProgressParser("/dev/sdb1")
+
+    events, lines = parser.feed("Creating filesystem with 65536 4k blocks\nWriting inode tables:  0/4")
+    assert lines == ["Creating filesystem with 65536 4k blocks"]
+    assert events == []
+
+    events, _ = parser.feed("\b\b\b\b 1/4\b\b\b\b 2/4\b\b\b\bdone\n")
+    assert [event.stage for event in events] == ["Writing inode tables"] * 4
+    assert [event.percent for event in events] == [0.0, 25.0, 50.0, 100.0]
+    assert all(event.label == "/dev/sdb1" for event in events)
+
+
+def test_progress_parser_reports_completion_once():
+    """
+    Test that "done" after a counter that already reached its total does not report 100% again.
+    """
+    parser = ProgressParser("/dev/sdb1")
+
+    events, _ = parser.feed("Writing superblocks and filesystem accounting information: 0/4\b\b\b4/4\b\b\bdone\n")
+
+    assert [event.percent for event in events] == [0.0, 100.0]
+
+
+def test_stream_command_publishes_progress(mocker):
+    """
+    Test that stream_command forwards progress events and returns stdout.
+    """
+    mock_logger = mocker.Mock()
+    events = []
+
+    output = stream_command(
+        r"printf 'Writing inode tables: 0/2\b\b\b1/2\b\b\bdone\nfinished\n'",
+        mock_logger,
+        on_progress=events.append,
+        label="test",
+    )
+
+    assert output == "finished"
+    assert [event.percent for event in events] == [0.0, 50.0, 100.0]
+    mock_logger.info.assert_any_call("[test] Writing inode tables: 100.0%, ETA 00:00")
+
+
+def test_stream_command_failure(mocker):
+    """
+    Test that stream_command raises CalledProcessError with the captured stderr.
+    """
+    mock_logger = mocker.Mock()
+
+    command = "echo 'broken' >&2; exit 3"
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        stream_command(command, mock_logger)
+
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.stderr == "broken"
+    mock_logger.error.assert_called_once_with(f"Command '{command}' failed with error: broken")
@@ -0,0 +1,173 @@
+import os
+import socket
+import subprocess
+import threading
+import pytest
+
+paramiko = pytest.importorskip("paramiko")
+
+from endoreg_usb_encrypter.functions import (  # noqa: E402
+    SSHConnectionPool,
+    SSHExecutor,
+    provision_hosts,
+    run_command,
+    stream_command,
+    use_executor,
+)
+from endoreg_usb_encrypter.functions.base import write_key_file  # noqa: E402
+
+
+class StubServer(paramiko.ServerInterface):
+    """In-process SSH server that runs exec requests with the local shell."""
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        def run():
+            result = subprocess.run(command.decode("utf-8"), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            channel.sendall(result.stdout)
+            channel.sendall_stderr(result.stderr)
+            channel.send_exit_status(result.returncode)
+            channel.close()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+class StubSFTPHandle(paramiko.SFTPHandle):
+    def chattr(self, attr):
+        os.chmod(self.filename, attr.st_mode)
+        return paramiko.SFTP_OK
+
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+    """Minimal SFTP server supporting the write-only file access used for key files."""
+
+    def open(self, path, flags, attr):
+        handle = StubSFTPHandle(flags)
+        handle.filename = path
+        handle.writefile = open(path, "wb")
+        return handle
+
+
+@pytest.fixture(scope="module")
+def ssh_server():
+    host_key = paramiko.RSAKey.generate(1024)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    connections = []
+
+    def serve():
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StubSFTPServer)
+            transport.start_server(server=StubServer())
+            connections.append(transport)
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield listener.getsockname()[1], connections
+    listener.close()
+    for transport in connections:
+        transport.close()
+
+
+@pytest.fixture
+def pool():
+    with SSHConnectionPool(host_key_policy=paramiko.AutoAddPolicy(), connect_kwargs={"password": "test", "look_for_keys": False, "allow_agent": False}) as pool:
+        yield pool
+
+
+def test_ssh_executor_reuses_connection(mocker, ssh_server, pool):
+    """
+    Test that several commands run over a single pooled SSH connection.
+    """
+    port, connections = ssh_server
+    before = len(connections)
+    mock_logger = mocker.Mock()
+
+    with use_executor(SSHExecutor("127.0.0.1", pool, port=port, username="pool")):
+        outputs = [run_command(f"echo {i}", mock_logger) for i in range(5)]
+
+    assert outputs == ["0", "1", "2", "3", "4"]
+    assert len(connections) == before + 1
+
+
+def test_ssh_executor_failure_and_streaming(mocker, ssh_server, pool):
+    """
+    Test error propagation and streaming of remote command output.
+    """
+    port, _ = ssh_server
+    mock_logger = mocker.Mock()
+    events = []
+
+    with use_executor(SSHExecutor("127.0.0.1", pool, port=port, username="stream")):
+        with pytest.raises(subprocess.CalledProcessError) as excinfo:
+            run_command("echo 'remote failure' >&2; exit 4", mock_logger)
+        output = stream_command(r"printf 'Writing inode tables: 0/2\b\b\b2/2\b\b\bdone\nok\n'", mock_logger, on_progress=events.append)
+
+    assert excinfo.value.returncode == 4
+    assert excinfo.value.stderr == b"remote failure\n"
+    assert output == "ok"
+    assert [event.percent for event in events] == [0.0, 100.0]
+
+
+def test_ssh_executor_writes_key_files(mocker, ssh_server, pool, tmp_path):
+    """
+    Test that key files are written remotely with mode 0600 and copied to the key store.
+    """
+    port, _ = ssh_server
+    remote_key = tmp_path / "remote" / "key-sdx1.key"
+    remote_key.parent.mkdir()
+    key_store = tmp_path / "store"
+
+    with use_executor(SSHExecutor("127.0.0.1", pool, port=port, username="keys", key_store=str(key_store))):
+        write_key_file(str(remote_key), b"secret", mocker.Mock())
+
+    assert remote_key.read_bytes() == b"secret"
+    assert oct(remote_key.stat().st_mode & 0o777) == "0o600"
+    assert (key_store / "127.0.0.1" / "key-sdx1.key").read_bytes() == b"secret"
+
+
+def test_provision_hosts_runs_jobs_concurrently(mocker, ssh_server, pool, tmp_path):
+    """
+    Test that provision_hosts runs every job through its own host's executor and creates the remote key directories.
+    """
+    port, connections = ssh_server
+    before = len(connections)
+    mock_logger = mocker.Mock()
+
+    def fake_provision(device, logger, **kwargs):
+        return {"device": run_command(f"echo {device}", logger), "output_json": kwargs["output_json"]}
+
+    mocker.patch("endoreg_usb_encrypter.functions.remote.provision_device", side_effect=fake_provision)
+
+    results = provision_hosts(
+        [
+            {"host": "127.0.0.1", "port": port, "username": "a", "device": "/dev/sdx", "key_dir": str(tmp_path / "a" / "keys")},
+            {"host": "127.0.0.1", "port": port, "username": "b", "device": "/dev/sdy", "key_dir": str(tmp_path / "b" / "keys")},
+        ],
+        mock_logger,
+        pool=pool,
+    )
+
+    assert results == [
+        {"device": "/dev/sdx", "output_json": "127.0.0.1-sdx-output.json"},
+        {"device": "/dev/sdy", "output_json": "127.0.0.1-sdy-output.json"},
+    ]
+    # One pooled connection per SSH account
+    assert len(connections) == before + 2
+    for account in ("a", "b"):
+        assert oct((tmp_path / account / "keys").stat().st_mode & 0o777) == "0o700"
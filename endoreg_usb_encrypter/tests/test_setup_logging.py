@@ -1,44 +1,119 @@
+import json
 import logging
+import logging.handlers
 import pytest
-from endoreg_usb_encrypter.functions import setup_logging  # Ensure this import points to the right location
+from endoreg_usb_encrypter.functions import setup_logging, shutdown_logging, log_context  # Ensure this import points to the right location
 
-def test_setup_logging(mocker):
+
+@pytest.fixture
+def logger_cleanup():
+    yield
+    shutdown_logging()
+
+
+def test_setup_logging(tmp_path, logger_cleanup):
+    """
+    Test the setup_logging function to ensure that it routes records through a
+    single queue handler and writes them to the log file.
+    """
+    log_file = tmp_path / "test_log.log"
+
+    logger = setup_logging(str(log_file))
+
+    # Verify the logger name and level
+    assert logger.name == "USBEncryption"
+    assert logger.level == logging.DEBUG
+
+    # Only the queue handler is attached to the logger itself
+    queue_handlers = [h for h in logger.handlers if isinstance(h, logging.handlers.QueueHandler)]
+    assert len(queue_handlers) == 1
+
+    logger.debug("debug message")
+    shutdown_logging()
+
+    content = log_file.read_text()
+    assert "DEBUG - debug message" in content
+
+
+def test_setup_logging_is_idempotent(tmp_path, logger_cleanup):
+    """
+    Test that repeated calls do not duplicate handlers or log lines.
     """
-    Test the setup_logging function to ensure that it correctly configures
-    the logger, file handler, and console handler.
+    log_file = tmp_path / "test_log.log"
+
+    logger = setup_logging(str(log_file))
+    handlers = list(logger.handlers)
+    assert setup_logging(str(log_file)) is logger
+    assert logger.handlers == handlers
+
+    logger.info("only once")
+    shutdown_logging()
+
+    assert log_file.read_text().count("only once") == 1
+
+
+def test_setup_logging_json_and_device_files(tmp_path, logger_cleanup):
+    """
+    Test the JSON-lines output with context fields and the per-device log files.
     """
-    # Mocking the necessary components
-    mock_get_logger = mocker.patch('logging.getLogger')  # Patching logging.getLogger
-    mock_file_handler = mocker.patch('logging.FileHandler')  # Patching logging.FileHandler
-    mock_stream_handler = mocker.patch('logging.StreamHandler')  # Patching logging.StreamHandler
+    log_file = tmp_path / "test_log.log"
+    json_log_file = tmp_path / "test_log.jsonl"
+    device_log_dir = tmp_path / "devices"
 
-    # Mock logger object returned by getLogger
-    mock_logger = mocker.Mock()
-    mock_get_logger.return_value = mock_logger
+    logger = setup_logging(str(log_file), json_log_file=str(json_log_file), device_log_dir=str(device_log_dir))
 
-    # Call the setup_logging function
-    logger = setup_logging("test_log.log")
+    with log_context(device="/dev/sdb", step="encrypt"):
+        with log_context(partition="/dev/sdb1"):
+            logger.info("encrypting")
+    logger.info("no context")
+    shutdown_logging()
 
-    # Verify logging.getLogger was called with the correct logger name
-    mock_get_logger.assert_called_once_with("USBEncryption")
+    entries = [json.loads(line) for line in json_log_file.read_text().splitlines()]
+    assert entries[0]["message"] == "encrypting"
+    assert entries[0]["device"] == "/dev/sdb"
+    assert entries[0]["partition"] == "/dev/sdb1"
+    assert entries[0]["step"] == "encrypt"
+    assert entries[1]["device"] is None
 
-    # Verify that logger's level is set to DEBUG
-    mock_logger.setLevel.assert_called_once_with(logging.DEBUG)
+    assert "[sdb/sdb1/encrypt] encrypting" in log_file.read_text()
+    device_log = (device_log_dir / "sdb.log").read_text()
+    assert "encrypting" in device_log
+    assert "no context" not in device_log
 
-    # Verify that StreamHandler was created and set to INFO level
-    mock_stream_handler.assert_called_once()  # Ensures StreamHandler was created
-    created_stream_handler = mock_stream_handler.return_value
-    created_stream_handler.setLevel.assert_called_once_with(logging.INFO)
 
-    # Verify that FileHandler was created with the correct log file
-    mock_file_handler.assert_called_once_with("test_log.log")
-    created_file_handler = mock_file_handler.return_value
-    created_file_handler.setLevel.assert_called_once_with(logging.DEBUG)
+def test_setup_logging_device_files_per_host(tmp_path, logger_cleanup):
+    """
+    Test that two hosts provisioning the same device path write to separate device log files.
+    """
+    device_log_dir = tmp_path / "devices"
+
+    logger = setup_logging(str(tmp_path / "test_log.log"), device_log_dir=str(device_log_dir))
+    for host in ("node-a", "node-b"):
+        with log_context(host=host, device="/dev/sdb"):
+            logger.info(f"provisioning on {host}")
+    shutdown_logging()
+
+    assert sorted(p.name for p in device_log_dir.iterdir()) == ["node-a-sdb.log", "node-b-sdb.log"]
+    assert "provisioning on node-a" in (device_log_dir / "node-a-sdb.log").read_text()
+    assert "node-b" not in (device_log_dir / "node-a-sdb.log").read_text()
 
-    # Ensure that both handlers were added to the logger
-    mock_logger.addHandler.assert_any_call(created_stream_handler)
-    mock_logger.addHandler.assert_any_call(created_file_handler)
 
-    # Assert that the logger returned by the function is the mock logger
-    assert logger == mock_logger
+def test_setup_logging_keeps_exceptions_separate(tmp_path, logger_cleanup):
+    """
+    Test that a logged exception is its own JSON field and still follows the message in the text log.
+    """
+    log_file = tmp_path / "test_log.log"
+    json_log_file = tmp_path / "test_log.jsonl"
+
+    logger = setup_logging(str(log_file), json_log_file=str(json_log_file))
+    try:
+        raise RuntimeError("device busy")
+    except RuntimeError:
+        logger.exception("cleanup failed")
+    shutdown_logging()
 
+    entry = json.loads(json_log_file.read_text())
+    assert entry["message"] == "cleanup failed"
+    assert entry["exception"].startswith("Traceback")
+    assert "RuntimeError: device busy" in entry["exception"]
+    assert "ERROR - cleanup failed\nTraceback" in log_file.read_text()
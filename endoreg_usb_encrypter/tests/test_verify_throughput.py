@@ -0,0 +1,72 @@
+import pytest
+from endoreg_usb_encrypter.functions import ThroughputBelowFloorError, probe_device_read, provision_device, use_executor, verify_throughput
+
+MIB = 1024 * 1024
+
+
+@pytest.fixture
+def hdd_info(tmp_path):
+    """A provisioned device with one partition: a raw image file and its 'mounted' volume directory."""
+    raw_partition = tmp_path / "sdx1"
+    raw_partition.write_bytes(b"\0" * 4 * MIB)
+    (tmp_path / "mnt" / "luks-sdx1").mkdir(parents=True)
+    return {"device": str(tmp_path / "sdx"), "partitions": [{"partition": str(raw_partition)}]}
+
+
+def test_verify_throughput_records_results(mocker, hdd_info, tmp_path):
+    """
+    Test that volume and raw probes are recorded in the HDD info and the probe file is removed.
+    """
+    result = verify_throughput(hdd_info, str(tmp_path / "mnt"), mocker.Mock(), size=2 * MIB, min_write_mbps=0.001)
+
+    throughput = result["partitions"][0]["throughput"]
+    assert set(throughput) == {"direct", "buffered", "raw", "encryption_overhead", "below_floor"}
+    assert throughput["direct"]["size"] == 2 * MIB
+    assert throughput["direct"]["seq_write"] > 0
+    assert throughput["raw"]["seq_read"] > 0
+    assert throughput["below_floor"] is False
+    assert result["throughput"]["below_floor"] is False
+    assert list((tmp_path / "mnt" / "luks-sdx1").iterdir()) == []
+
+
+def test_verify_throughput_below_floor(mocker, hdd_info, tmp_path):
+    """
+    Test that drives below the floor fail, or are only flagged when requested.
+    """
+    mock_logger = mocker.Mock()
+
+    with pytest.raises(ThroughputBelowFloorError):
+        verify_throughput(hdd_info, str(tmp_path / "mnt"), mock_logger, size=MIB, min_write_mbps=10 ** 9)
+
+    result = verify_throughput(hdd_info, str(tmp_path / "mnt"), mock_logger, size=MIB, min_write_mbps=10 ** 9, fail_below_floor=False)
+    assert result["partitions"][0]["throughput"]["below_floor"] is True
+    assert result["throughput"]["below_floor"] is True
+
+
+def test_probe_device_read_does_not_write(tmp_path):
+    """
+    Test that the raw device probe leaves the device content untouched.
+    """
+    device = tmp_path / "raw"
+    content = bytes(range(256)) * 4096
+    device.write_bytes(content)
+
+    result = probe_device_read(str(device), size=MIB)
+
+    assert result["size"] == MIB
+    assert device.read_bytes() == content
+
+
+def test_throughput_probes_refuse_remote_devices(mocker, hdd_info, tmp_path):
+    """
+    Test that probes are refused under an executor, before provisioning touches the device.
+    """
+    mock_cleanup = mocker.patch("endoreg_usb_encrypter.functions.provision.cleanup_device")
+
+    with use_executor(mocker.Mock()):
+        with pytest.raises(ValueError):
+            verify_throughput(hdd_info, str(tmp_path / "mnt"), mocker.Mock(), size=MIB)
+        with pytest.raises(ValueError):
+            provision_device("/dev/sdx", ["data"], [1], str(tmp_path / "mnt"), str(tmp_path / "keys"), mocker.Mock(), probe_size=MIB)
+
+    mock_cleanup.assert_not_called()